@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, File, Form, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+
+# Node types whose output is handed back through /history and /view
+SAVE_NODES = {"SaveImage": ".png", "SaveVideo": ".mp4", "VHS_VideoCombine": ".mp4"}
+
+
+class MockComfyUI:
+    """
+    Stand-in for one ComfyUI server: the HTTP routes and WebSocket events the
+    middleware uses, with prompts executed one at a time like a single GPU.
+
+    A prompt takes `prompt_seconds` plus `output_seconds` per output node (a
+    batched prompt has one output node per image), varied by +/- `jitter`.
+    Every output file is `output_bytes` long. Busy intervals are recorded so
+    the benchmark can tell how much of the run the "GPU" sat idle.
+    """
+    def __init__(self, prompt_seconds: float = 0.0, output_seconds: float = 0.5, output_bytes: int = 256 * 1024,
+                 jitter: float = 0.0, progress_steps: int = 4, max_history: int = 10000):
+        self.prompt_seconds = prompt_seconds
+        self.output_seconds = output_seconds
+        self.jitter = jitter
+        self.progress_steps = max(1, progress_steps)
+        self.max_history = max_history
+        self.output = os.urandom(output_bytes)
+
+        self.history: "OrderedDict[str, Dict]" = OrderedDict()
+        self.sockets: Dict[str, WebSocket] = {}
+        self.pending: "OrderedDict[str, Tuple[int, Dict, Optional[str]]]" = OrderedDict()
+        self.running: Optional[Tuple[int, str]] = None
+        self.interrupted = False
+        self.counter = 0
+        self.wakeup: Optional[asyncio.Event] = None
+
+        self.busy: List[Tuple[float, float]] = []
+        self.prompts = 0
+        self.outputs = 0
+        self.uploaded_bytes = 0
+        self.app = self._build_app()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.on_event("startup")
+        async def start_executor():
+            self.wakeup = asyncio.Event()
+            asyncio.create_task(self._execute_loop())
+
+        @app.post("/upload/image")
+        async def upload_image(image: UploadFile = File(...), overwrite: str = Form("false"),
+                               subfolder: str = Form(""), type: str = Form("input")):
+            while True:
+                chunk = await image.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.uploaded_bytes += len(chunk)
+            return {"name": image.filename, "subfolder": subfolder, "type": type}
+
+        @app.post("/prompt")
+        async def queue_prompt(request: Request):
+            body = await request.json()
+            prompt = body.get("prompt") or {}
+            if not prompt:
+                return JSONResponse({"error": {"type": "prompt_no_outputs", "message": "Prompt has no nodes"}, "node_errors": {}},
+                                    status_code=400)
+            prompt_id = str(uuid.uuid4())
+            self.counter += 1
+            self.pending[prompt_id] = (self.counter, prompt, body.get("client_id"))
+            self.wakeup.set()
+            return {"prompt_id": prompt_id, "number": self.counter, "node_errors": {}}
+
+        @app.get("/history/{prompt_id}")
+        async def get_history(prompt_id: str):
+            entry = self.history.get(prompt_id)
+            return {prompt_id: entry} if entry is not None else {}
+
+        @app.get("/view")
+        async def view(filename: str, subfolder: str = "", type: str = "output"):
+            media_type = "video/mp4" if filename.endswith(".mp4") else "image/png"
+            return Response(self.output, media_type=media_type)
+
+        @app.get("/system_stats")
+        async def system_stats():
+            return {
+                "system": {"os": "posix", "python_version": "mock", "embedded_python": False},
+                "devices": [{"name": "mock", "type": "cuda", "index": 0,
+                             "vram_total": 24 << 30, "vram_free": 20 << 30, "torch_vram_total": 0, "torch_vram_free": 0}]
+            }
+
+        @app.get("/queue")
+        async def get_queue():
+            running = [[self.running[0], self.running[1], {}, {}, []]] if self.running else []
+            pending = [[number, prompt_id, {}, {}, []] for prompt_id, (number, _, _) in self.pending.items()]
+            return {"queue_running": running, "queue_pending": pending}
+
+        @app.post("/queue")
+        async def edit_queue(request: Request):
+            body = await request.json()
+            for prompt_id in body.get("delete", []):
+                self.pending.pop(prompt_id, None)
+            if body.get("clear"):
+                self.pending.clear()
+            return {}
+
+        @app.post("/interrupt")
+        async def interrupt(request: Request):
+            body = await request.body()
+            prompt_id = json.loads(body).get("prompt_id") if body else None
+            if self.running and prompt_id in (None, self.running[1]):
+                self.interrupted = True
+            return {}
+
+        @app.websocket("/ws")
+        async def ws(websocket: WebSocket, clientId: str = ""):
+            await websocket.accept()
+            client_id = clientId or uuid.uuid4().hex
+            self.sockets[client_id] = websocket
+            await websocket.send_text(json.dumps({"type": "status", "data": {
+                "status": {"exec_info": {"queue_remaining": len(self.pending)}}, "sid": client_id}}))
+            try:
+                while True:
+                    await websocket.receive_text()
+            except WebSocketDisconnect:
+                pass
+            finally:
+                if self.sockets.get(client_id) is websocket:
+                    del self.sockets[client_id]
+
+        return app
+
+    async def _send(self, client_id: Optional[str], event_type: str, data: Dict):
+        websocket = self.sockets.get(client_id)
+        if websocket is None:
+            return
+        try:
+            await websocket.send_text(json.dumps({"type": event_type, "data": data}))
+        except Exception:
+            pass # The client went away; it reconciles through /history
+
+    async def _execute_loop(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            prompt_id, (number, prompt, client_id) = self.pending.popitem(last=False)
+            self.running = (number, prompt_id)
+            self.interrupted = False
+            start = time.time()
+            try:
+                await self._execute(prompt_id, prompt, client_id)
+            except Exception as e:
+                print(f"[MockComfyUI] Prompt {prompt_id} failed: {e}")
+            finally:
+                self.busy.append((start, time.time()))
+                self.running = None
+
+    async def _execute(self, prompt_id: str, prompt: Dict, client_id: Optional[str]):
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        await self._send(client_id, "execution_cached", {"nodes": [], "prompt_id": prompt_id})
+
+        save_nodes = [node_id for node_id, node in prompt.items() if node.get("class_type") in SAVE_NODES]
+        duration = self.prompt_seconds + self.output_seconds * len(save_nodes)
+        if self.jitter:
+            duration *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        # The time goes to the first node that does the work: one upscaler per output
+        work_nodes = set(save_nodes)
+        step = duration / (self.progress_steps * max(len(work_nodes), 1))
+
+        outputs = {}
+        for node_id, node in prompt.items():
+            await self._send(client_id, "executing", {"node": node_id, "display_node": node_id, "prompt_id": prompt_id})
+            if node_id in work_nodes or (not work_nodes and node_id == next(iter(prompt))):
+                for value in range(1, self.progress_steps + 1):
+                    await asyncio.sleep(step)
+                    if self.interrupted:
+                        await self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node_id,
+                                                                              "node_type": node.get("class_type")})
+                        return
+                    await self._send(client_id, "progress", {"value": value, "max": self.progress_steps,
+                                                             "prompt_id": prompt_id, "node": node_id})
+            if node_id in work_nodes:
+                filename = f"mock_{prompt_id[:8]}_{node_id}{SAVE_NODES[node['class_type']]}"
+                outputs[node_id] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+                await self._send(client_id, "executed", {"node": node_id, "display_node": node_id,
+                                                         "output": outputs[node_id], "prompt_id": prompt_id})
+
+        self.history[prompt_id] = {
+            "prompt": [self.running[0] if self.running else 0, prompt_id, prompt, {"client_id": client_id}, save_nodes],
+            "outputs": outputs,
+            "status": {"status_str": "success", "completed": True, "messages": []}
+        }
+        while len(self.history) > self.max_history:
+            self.history.popitem(last=False)
+        self.prompts += 1
+        self.outputs += len(outputs)
+        await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+        await self._send(client_id, "execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
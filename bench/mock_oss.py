@@ -0,0 +1,62 @@
+import hashlib
+import re
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class MockOSS:
+    """
+    Stand-in for the OSS bucket, addressed path-style (`/{bucket}/{key}`) as
+    oss2 does for IP endpoints. It serves the benchmark's task inputs from
+    memory, with single byte ranges like the real thing, and accepts simple
+    PUT uploads, counting the bytes and dropping them.
+
+    Multipart uploads are not implemented; the benchmark raises the multipart
+    threshold above its output size instead.
+    """
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.downloaded_bytes = 0
+        self.app = self._build_app()
+
+    def put_object(self, key: str, data: bytes):
+        self.objects[key] = data
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/{bucket}/{key:path}")
+        async def get_object(bucket: str, key: str, request: Request):
+            data = self.objects.get(key)
+            if data is None:
+                return Response(status_code=404)
+            headers = {"ETag": f'"{hashlib.md5(key.encode("utf-8")).hexdigest()}"', "Accept-Ranges": "bytes"}
+            match = _RANGE.match(request.headers.get("range", ""))
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+                else:
+                    start, end = max(len(data) - int(match.group(2)), 0), len(data) - 1
+                if start > end:
+                    return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+                self.downloaded_bytes += end - start + 1
+                return Response(data[start:end + 1], status_code=206, headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"})
+            self.downloaded_bytes += len(data)
+            return Response(data, headers=headers)
+
+        @app.put("/{bucket}/{key:path}")
+        async def put_object(bucket: str, key: str, request: Request):
+            async for chunk in request.stream():
+                self.uploaded_bytes += len(chunk)
+            self.uploads += 1
+            return Response(status_code=200, headers={"ETag": f'"{hashlib.md5(key.encode("utf-8")).hexdigest().upper()}"',
+                                                      "x-oss-request-id": f"mock-{self.uploads}"})
+
+        return app
@@ -0,0 +1,361 @@
+"""
+Benchmark of the middleware itself: throughput, end-to-end latency, GPU idle
+time and memory, against local stand-ins for ComfyUI and OSS.
+
+    python -m bench.run --servers 4 --tasks 200 --mix image:esrgan_image_2x=3,video:esrgan_video_1920=1
+
+The server under test (server.main:app) runs in its own process, started in a
+scratch directory with a generated config.yaml; --config merges a YAML file
+over it, e.g. to turn batching on.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import requests
+import uvicorn
+import yaml
+from PIL import Image
+
+from .mock_comfyui import MockComfyUI
+from .mock_oss import MockOSS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET = "bench"
+TERMINAL = {"completed", "failed", "canceled"}
+
+
+def parse_mix(text: str) -> List[Tuple[str, str, float]]:
+    """"image:esrgan_image_2x=3,video:esrgan_video_1920=1" -> [(type, workflow, weight)]"""
+    mix = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        spec, _, weight = item.partition("=")
+        task_type, _, workflow = spec.partition(":")
+        if task_type not in ("image", "video") or not workflow:
+            raise ValueError(f"Bad mix entry {item!r}, expected type:workflow[=weight] with type image or video")
+        mix.append((task_type, workflow, float(weight) if weight else 1.0))
+    if not mix:
+        raise ValueError("Empty task mix")
+    return mix
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    """Run an ASGI app on its own thread and event loop."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error", lifespan="on"))
+    threading.Thread(target=server.run, name=f"mock-{port}", daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return server
+
+
+def deep_merge(base: Dict, overlay: Dict) -> Dict:
+    merged = dict(base)
+    for key, value in overlay.items():
+        merged[key] = deep_merge(merged[key], value) if isinstance(value, dict) and isinstance(merged.get(key), dict) else value
+    return merged
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def parse_time(value: str) -> float:
+    return datetime.fromisoformat(value.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+
+def busy_within(intervals: List[Tuple[float, float]], start: float, end: float) -> float:
+    return sum(max(0.0, min(b, end) - max(a, start)) for a, b in intervals)
+
+
+def make_image(size: str) -> bytes:
+    """A noise PNG, so it neither compresses nor caches away."""
+    width, _, height = size.partition("x")
+    width, height = int(width), int(height or width)
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ServerProcess:
+    """server.main:app under uvicorn, in a scratch working directory."""
+    def __init__(self, workdir: str, config: Dict, port: int):
+        self.workdir = workdir
+        self.port = port
+        self.base = f"http://127.0.0.1:{port}"
+        with open(os.path.join(workdir, "config.yaml"), "w", encoding="utf-8") as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+        # Workflows are looked up relative to the working directory
+        try:
+            os.symlink(os.path.join(ROOT, "workflows"), os.path.join(workdir, "workflows"))
+        except OSError:
+            shutil.copytree(os.path.join(ROOT, "workflows"), os.path.join(workdir, "workflows"))
+        self.log_path = os.path.join(workdir, "server.log")
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        env["PYTHONUNBUFFERED"] = "1"
+        self.log = open(self.log_path, "w", encoding="utf-8")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server.main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, servers: int, timeout: float = 60):
+        """Until the API answers and the pool sees every mock server as up."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log_path}")
+            try:
+                metrics = requests.get(f"{self.base}/metrics", timeout=2).text
+                up = sum(1 for line in metrics.splitlines() if line.startswith("tmlsr_comfyui_up{") and line.endswith(" 1"))
+                if up >= servers:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError(f"Server not ready after {timeout:.0f}s, see {self.log_path}")
+
+    def peak_rss(self) -> Optional[int]:
+        """High-water resident set size in bytes, while the process is alive (Linux)."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self) -> Optional[int]:
+        """Stop the server; returns its peak RSS in bytes when it can be read."""
+        if self.process is None:
+            return None
+        peak = self.peak_rss()
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        if peak is None:
+            try:
+                import resource
+                # ru_maxrss is in KiB on Linux, bytes on macOS
+                scale = 1 if sys.platform == "darwin" else 1024
+                peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+            except ImportError:
+                pass
+        return peak
+
+
+def submit(base: str, tasks: List[Dict], rate: float, chunk: int, submitted: List[str], lock: threading.Lock):
+    """Submit tasks in chunks through /tasks/batch, or one by one at `rate` per second."""
+    if rate <= 0:
+        for i in range(0, len(tasks), chunk):
+            response = requests.post(f"{base}/tasks/batch", json=tasks[i:i + chunk], timeout=60)
+            response.raise_for_status()
+            with lock:
+                submitted.extend(response.json()["task_ids"])
+        return
+    start = time.time()
+    for i, task in enumerate(tasks):
+        delay = start + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        response = requests.post(f"{base}/tasks", json=task, timeout=60)
+        response.raise_for_status()
+        with lock:
+            submitted.append(response.json()["task_id"])
+
+
+def collect(base: str, total: int, submitted: List[str], lock: threading.Lock, submitter: threading.Thread,
+            timeout: float, poll: float, chunk: int) -> Dict[str, Dict]:
+    """Poll until every submitted task is finished; returns the final task records."""
+    finished: Dict[str, Dict] = {}
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with lock:
+            outstanding = [task_id for task_id in submitted if task_id not in finished]
+        for i in range(0, len(outstanding), chunk):
+            response = requests.post(f"{base}/tasks/query", json={"ids": outstanding[i:i + chunk]}, timeout=30)
+            response.raise_for_status()
+            for task in response.json()["tasks"]:
+                if task["status"] in TERMINAL:
+                    finished[task["task_id"]] = task
+        if len(finished) >= total or (not submitter.is_alive() and len(finished) >= len(submitted)):
+            break
+        time.sleep(poll)
+    return finished
+
+
+def build_tasks(args, mix, oss: MockOSS, oss_base: str) -> List[Dict]:
+    rng = random.Random(args.seed)
+    image = make_image(args.image_size)
+    video = os.urandom(args.video_kb * 1024)
+    weights = [weight for _, _, weight in mix]
+    tasks = []
+    for i in range(args.tasks):
+        task_type, workflow, _ = rng.choices(mix, weights)[0]
+        key = f"inputs/{i}.png" if task_type == "image" else f"inputs/{i}.mp4"
+        # One blob, many keys: distinct URLs without the memory of distinct files
+        oss.put_object(key, image if task_type == "image" else video)
+        tasks.append({"url": f"{oss_base}/{BUCKET}/{key}", "type": task_type, "workflow": workflow,
+                      "priority": 0, "bypass_cache": True})
+    return tasks
+
+
+def report(results: Dict, json_path: Optional[str]):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f} ms"
+
+    print()
+    print(f"Tasks            {results['completed']} completed, {results['failed']} failed, "
+          f"{results['unfinished']} unfinished of {results['tasks']}")
+    print(f"Wall time        {results['wall_seconds']:.2f} s")
+    print(f"Throughput       {results['tasks_per_second']:.2f} tasks/s")
+    print(f"Latency          p50 {ms(results['latency_p50'])}, p90 {ms(results['latency_p90'])}, "
+          f"p99 {ms(results['latency_p99'])}, max {ms(results['latency_max'])}")
+    print(f"GPU idle         {results['gpu_idle_fraction'] * 100:.1f}% of {results['servers']} servers x wall time")
+    print(f"Prompts          {results['prompts']} ({results['outputs_per_prompt']:.2f} outputs per prompt)")
+    peak = results["server_peak_rss_bytes"]
+    print(f"Server peak RSS  {'-' if peak is None else f'{peak / 1024 / 1024:.1f} MB'}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", type=int, default=2, help="Mock ComfyUI servers")
+    parser.add_argument("--slots", type=int, default=1, help="comfyui.inflight_per_server")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--mix", default="image:esrgan_image_2x=1", help="type:workflow=weight,...")
+    parser.add_argument("--rate", type=float, default=0, help="Arrivals per second; 0 submits everything at once")
+    parser.add_argument("--prompt-ms", type=float, default=50, help="Fixed execution time per prompt")
+    parser.add_argument("--output-ms", type=float, default=200, help="Execution time per output (per image of a batch)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Relative spread of execution time, e.g. 0.2")
+    parser.add_argument("--output-kb", type=int, default=256, help="Size of every output file")
+    parser.add_argument("--image-size", default="256x256", help="Input image size, WxH")
+    parser.add_argument("--video-kb", type=int, default=1024, help="Input video size")
+    parser.add_argument("--config", help="YAML merged over the generated config.yaml")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--poll", type=float, default=0.2, help="Status poll interval")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory (config, server log)")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    comfys = [MockComfyUI(prompt_seconds=args.prompt_ms / 1000, output_seconds=args.output_ms / 1000,
+                          output_bytes=args.output_kb * 1024, jitter=args.jitter) for _ in range(args.servers)]
+    comfy_ports = [free_port() for _ in comfys]
+    for comfy, port in zip(comfys, comfy_ports):
+        serve(comfy.app, port)
+    oss = MockOSS()
+    oss_port = free_port()
+    serve(oss.app, oss_port)
+    oss_base = f"http://127.0.0.1:{oss_port}"
+
+    config = {
+        "oss": {"endpoint": oss_base, "access_key_id": "bench", "access_key_secret": "bench", "bucket_name": BUCKET,
+                # The mock takes simple uploads only
+                "multipart_threshold_mb": max(1024, args.output_kb // 1024 * 2)},
+        "store": {"backend": "memory"},
+        "video_fanout": {"enabled": False},
+        "comfyui": {"servers": [f"http://127.0.0.1:{port}" for port in comfy_ports], "inflight_per_server": args.slots},
+        "server": {"max_batch_tasks": 1000},
+    }
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = deep_merge(config, yaml.safe_load(f) or {})
+
+    workdir = tempfile.mkdtemp(prefix="tmlsr-bench-")
+    server = ServerProcess(workdir, config, free_port())
+    peak = None
+    try:
+        tasks = build_tasks(args, mix, oss, oss_base)
+        server.start()
+        server.wait_ready(args.servers)
+        print(f"Running {args.tasks} tasks on {args.servers} mock servers ({args.mix})...")
+
+        submitted: List[str] = []
+        lock = threading.Lock()
+        chunk = config["server"].get("max_batch_tasks", 1000)
+        submitter = threading.Thread(target=submit, args=(server.base, tasks, args.rate, chunk, submitted, lock), daemon=True)
+        submitter.start()
+        finished = collect(server.base, len(tasks), submitted, lock, submitter, args.timeout, args.poll, chunk)
+        peak = server.stop()
+    finally:
+        if server.process is not None and server.process.poll() is None:
+            server.stop()
+        if args.keep:
+            print(f"Scratch directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    done = [task for task in finished.values() if task["status"] == "completed"]
+    # Server-side timestamps: from acceptance to the final status, free of polling delay
+    latencies = [parse_time(task["updated_at"]) - parse_time(task["created_at"]) for task in done]
+    start = min((parse_time(task["created_at"]) for task in finished.values()), default=0.0)
+    end = max((parse_time(task["updated_at"]) for task in finished.values()), default=start)
+    wall = max(end - start, 1e-9)
+    busy = sum(busy_within(comfy.busy, start, end) for comfy in comfys)
+    prompts = sum(comfy.prompts for comfy in comfys)
+
+    for task in finished.values():
+        if task["status"] != "completed":
+            print(f"Task {task['task_id']} {task['status']}: {task.get('error')}")
+    report({
+        "tasks": len(tasks),
+        "completed": len(done),
+        "failed": len(finished) - len(done),
+        "unfinished": len(tasks) - len(finished),
+        "servers": args.servers,
+        "mix": args.mix,
+        "wall_seconds": round(wall, 3),
+        "tasks_per_second": round(len(done) / wall, 3),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=None),
+        "gpu_idle_fraction": round(1 - busy / (args.servers * wall), 4),
+        "prompts": prompts,
+        "outputs_per_prompt": round(sum(comfy.outputs for comfy in comfys) / prompts, 3) if prompts else 0.0,
+        "oss_uploaded_bytes": oss.uploaded_bytes,
+        "server_peak_rss_bytes": peak,
+    }, args.json)
+    return 0 if len(done) == len(tasks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+
+
+class MicroBatcher:
+    """
+    Collects ready tasks by key (workflow and size class) and hands them to
+    `emit` as lists of up to max_batch task IDs, as soon as a group is full or
+    its oldest task has waited max_wait seconds. A group of one is emitted as
+    a plain task ID. add() blocks while `capacity` tasks are waiting.
+    """
+    def __init__(self, emit: Callable, max_batch: int = 8, max_wait: float = 0.2, capacity: Optional[int] = None):
+        self.emit = emit
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.capacity = capacity or 2 * self.max_batch
+        self.groups = OrderedDict() # key -> [oldest add time, [task_id]]
+        self.pending = 0
+        self.cond = threading.Condition()
+        threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+
+    def add(self, key: Hashable, task_id: str):
+        with self.cond:
+            while self.pending >= self.capacity:
+                self.cond.wait()
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = [time.time(), []]
+            group[1].append(task_id)
+            self.pending += 1
+            self.cond.notify_all()
+
+    def qsize(self) -> int:
+        with self.cond:
+            return self.pending
+
+    def _take(self, now: float) -> Optional[List[str]]:
+        """Remove and return a batch that is full or due. Caller must hold self.cond."""
+        for key, (since, task_ids) in self.groups.items():
+            if len(task_ids) >= self.max_batch or now - since >= self.max_wait:
+                batch = task_ids[:self.max_batch]
+                if len(task_ids) > len(batch):
+                    self.groups[key] = [now, task_ids[len(batch):]]
+                else:
+                    del self.groups[key]
+                return batch
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.time()
+                    batch = self._take(now)
+                    if batch:
+                        break
+                    deadlines = [since + self.max_wait for since, _ in self.groups.values()]
+                    self.cond.wait(timeout=max(min(deadlines) - now, 0.001) if deadlines else None)
+                self.pending -= len(batch)
+                self.cond.notify_all()
+            try:
+                # May block while the GPU stage is backed up
+                self.emit(batch if len(batch) > 1 else batch[0])
+            except Exception as e:
+                print(f"Micro-batcher error: {e}")
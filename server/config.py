@@ -18,10 +18,61 @@ class Settings:
     def oss_config(self):
         return self._config.get("oss", {})
 
+    @property
+    def store_config(self):
+        return self._config.get("store", {})
+
+    @property
+    def scheduler_config(self):
+        return self._config.get("scheduler", {})
+
+    @property
+    def cache_config(self):
+        return self._config.get("cache", {})
+
+    @property
+    def download_config(self):
+        return self._config.get("download", {})
+
+    @property
+    def fanout_config(self):
+        return self._config.get("video_fanout", {})
+
+    @property
+    def tiling_config(self):
+        return self._config.get("tiling", {})
+
+    @property
+    def batching_config(self):
+        return self._config.get("batching", {})
+
+    @property
+    def tracing_config(self):
+        return self._config.get("tracing", {})
+
     @property
     def max_workers(self):
         return self._config.get("server", {}).get("max_workers", 2) # Limit concurrent heavy tasks
 
+    @property
+    def download_workers(self):
+        # Inputs fetched concurrently, independent of the number of GPU servers
+        return self._config.get("server", {}).get("download_workers", 4)
+
+    @property
+    def upload_workers(self):
+        return self._config.get("server", {}).get("upload_workers", 2)
+
+    @property
+    def pipeline_buffer(self):
+        # Downloaded tasks waiting for a GPU server; 0 means twice the server count
+        return self._config.get("server", {}).get("pipeline_buffer", 0)
+
+    @property
+    def upload_buffer(self):
+        # Processed tasks waiting for an upload worker; 0 means twice upload_workers
+        return self._config.get("server", {}).get("upload_buffer", 0)
+
     @property
     def max_retries(self):
         return self._config.get("server", {}).get("max_retries", 3)
@@ -30,6 +81,77 @@ class Settings:
     def retry_delay(self):
         return self._config.get("server", {}).get("retry_delay", 5)
 
+    @property
+    def retry_max_delay(self):
+        # Upper bound of the exponential retry backoff
+        return self._config.get("server", {}).get("retry_max_delay", 300)
+
+    @property
+    def progress_interval(self):
+        # Minimum seconds between two progress updates of the same stage
+        return self._config.get("server", {}).get("progress_interval_ms", 250) / 1000.0
+
+    @property
+    def progress_min_delta(self):
+        # Minimum change in percent between two progress updates of the same stage
+        return self._config.get("server", {}).get("progress_min_delta", 1.0)
+
+    @property
+    def task_ttl_seconds(self):
+        # Finished tasks are forgotten this long after they finish
+        return self._config.get("server", {}).get("task_ttl_seconds", 7 * 24 * 3600)
+
+    @property
+    def max_finished_tasks(self):
+        # Upper bound on finished tasks kept in memory, oldest evicted first
+        return self._config.get("server", {}).get("max_finished_tasks", 10000)
+
+    @property
+    def monitor_recent_tasks(self):
+        return self._config.get("server", {}).get("monitor_recent_tasks", 50)
+
+    @property
+    def max_batch_tasks(self):
+        # Most tasks per POST /tasks/batch, IDs per bulk query and tasks per listing page
+        return self._config.get("server", {}).get("max_batch_tasks", 1000)
+
+    @property
+    def event_buffer_size(self):
+        # Events held per stream subscriber before it is told to resync
+        return self._config.get("server", {}).get("event_buffer_size", 256)
+
+    @property
+    def event_heartbeat_seconds(self):
+        return self._config.get("server", {}).get("event_heartbeat_seconds", 15)
+
+    @property
+    def monitor_event_interval(self):
+        # Seconds between pool / counter checks for /monitor/events
+        return self._config.get("server", {}).get("monitor_event_interval_ms", 1000) / 1000.0
+
+    @property
+    def comfyui_health(self):
+        return self._config.get("comfyui", {}).get("health", {})
+
+    @property
+    def comfyui_affinity(self):
+        return self._config.get("comfyui", {}).get("affinity", {})
+
+    @property
+    def comfyui_execution_timeout(self):
+        # Seconds a prompt may run, counted from ComfyUI's execution_start
+        return self._config.get("comfyui", {}).get("execution_timeout", 300)
+
+    @property
+    def comfyui_queue_timeout(self):
+        # Seconds a prompt may wait in a server's queue before it starts
+        return self._config.get("comfyui", {}).get("queue_timeout", 3600)
+
+    @property
+    def comfyui_inflight_per_server(self):
+        # Prompts each ComfyUI server holds at once (running plus queued behind it)
+        return self._config.get("comfyui", {}).get("inflight_per_server", 1)
+
     @property
     def comfyui_servers(self):
         # Return list of servers. Fallback to single server_address if servers list not present
@@ -0,0 +1,132 @@
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# Delivered in place of the buffered events when a subscriber fell behind;
+# the stream answers it with a fresh snapshot
+RESYNC = ("resync", None)
+
+
+class Subscription:
+    """
+    One stream's view of the hub: a bounded buffer filled from worker threads
+    and drained by the stream's coroutine on its event loop.
+
+    Events published with a key replace the buffered event with the same key
+    (progress of one stage), so a slow reader gets the latest state rather than
+    every step. When the buffer overflows the oldest events are dropped and the
+    reader is told to resync instead.
+    """
+    def __init__(self, topics: Iterable[str], loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.topics = tuple(topics)
+        self.loop = loop
+        self.maxsize = max(1, maxsize)
+        self.buffer = OrderedDict() # key -> (event_type, data)
+        self.lock = threading.Lock()
+        self.lagged = False
+        self.notified = False
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.counter = itertools.count()
+
+    def push(self, key: Optional[Hashable], event: Tuple[str, Dict]):
+        with self.lock:
+            if self.closed:
+                return
+            if key is None:
+                key = next(self.counter)
+            else:
+                # Move to the end, so it is still delivered after events published before it
+                self.buffer.pop(key, None)
+            self.buffer[key] = event
+            if len(self.buffer) > self.maxsize:
+                self.buffer.popitem(last=False)
+                self.lagged = True
+            if self.notified:
+                return
+            self.notified = True
+        self._wake()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            pass # The loop is gone; the stream is being torn down
+
+    async def get(self, timeout: float) -> Optional[List[Tuple[str, Dict]]]:
+        """
+        Wait up to `timeout` seconds for events and return all that are buffered,
+        [RESYNC] if some were dropped, [] on timeout or None once closed.
+        """
+        while True:
+            with self.lock:
+                if self.closed:
+                    return None
+                if self.lagged:
+                    self.lagged = False
+                    self.buffer.clear()
+                    self.notified = False
+                    return [RESYNC]
+                if self.buffer:
+                    events = list(self.buffer.values())
+                    self.buffer.clear()
+                    self.notified = False
+                    return events
+                self.notified = False
+                self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+
+class EventHub:
+    """
+    In-process pub/sub for task and pool updates. Publishing never blocks: each
+    subscriber has its own bounded buffer, and topics nobody listens to cost a
+    dict lookup.
+    """
+    def __init__(self, buffer_size: int = 256):
+        self.buffer_size = buffer_size
+        self.subscribers: Dict[str, Set[Subscription]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, *topics: str) -> Subscription:
+        """Subscribe the calling coroutine's event loop to `topics`."""
+        sub = Subscription(topics, asyncio.get_running_loop(), self.buffer_size)
+        with self.lock:
+            for topic in topics:
+                # Copy on write, so publishers can iterate without the lock
+                self.subscribers[topic] = self.subscribers.get(topic, set()) | {sub}
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self.lock:
+            for topic in sub.topics:
+                remaining = self.subscribers.get(topic, set()) - {sub}
+                if remaining:
+                    self.subscribers[topic] = remaining
+                else:
+                    self.subscribers.pop(topic, None)
+        sub.close()
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscribers.get(topic))
+
+    def publish(self, topic: str, event_type: str, data: Dict, key: Optional[Hashable] = None):
+        for sub in self.subscribers.get(topic, ()):
+            sub.push(key, (event_type, data))
+
+    def close(self):
+        with self.lock:
+            subs = {sub for topic_subs in self.subscribers.values() for sub in topic_subs}
+            self.subscribers = {}
+        for sub in subs:
+            sub.close()
@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import JSONResponse
+import json
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from .models import (
     TaskCreateRequest, 
     TaskResponse, 
+    TaskQueryRequest,
+    TaskListResponse,
     HealthResponse, 
     TaskStatus
 )
 from .task_manager import task_manager
+from .config import settings
+from .events import RESYNC
+from utils.metrics import REGISTRY
+from utils import tracing
 
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
@@ -22,6 +32,10 @@ app = FastAPI(
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(static_dir, exist_ok=True)
 
+@app.on_event("shutdown")
+def shutdown_task_manager():
+    task_manager.shutdown()
+
 app.mount("/dashboard", StaticFiles(directory=static_dir, html=True), name="dashboard")
 
 @app.get("/")
@@ -32,6 +46,59 @@ async def root():
 async def get_monitor_stats():
     return task_manager.get_monitor_stats()
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics: queue wait, stage durations per workflow, bytes moved,
+    retries and failures by reason, per-server busy time and in-flight counts.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def _sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+async def _event_stream(request: Request, topic, snapshot, until=None):
+    """
+    Server-Sent Events: a snapshot first, then the topic's events, with a
+    keep-alive comment when idle. A subscriber that fell behind gets a fresh
+    snapshot instead of what it missed. The stream ends once `until(event_type, data)`
+    is true or the client goes away.
+    """
+    # Subscribe before taking the snapshot, so nothing in between is missed
+    sub = task_manager.events.subscribe(topic)
+    try:
+        data = snapshot()
+        yield _sse("snapshot", data)
+        if until and until("snapshot", data):
+            return
+        while not await request.is_disconnected():
+            events = await sub.get(timeout=settings.event_heartbeat_seconds)
+            if events is None:
+                break
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_type, data in events:
+                if (event_type, data) == RESYNC:
+                    event_type, data = "snapshot", snapshot()
+                yield _sse(event_type, data)
+                if until and until(event_type, data):
+                    return
+    finally:
+        task_manager.events.unsubscribe(sub)
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+_FINISHED = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED)
+
+@app.get("/monitor/events")
+async def monitor_events(request: Request):
+    """
+    Push stream for the dashboard: the /monitor/stats snapshot, then task, status,
+    stage, summary and pool events.
+    """
+    return StreamingResponse(_event_stream(request, "monitor", task_manager.get_monitor_stats),
+                             media_type="text/event-stream", headers=_SSE_HEADERS)
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     return {"status": "ok"}
@@ -44,6 +111,82 @@ async def create_task(request: TaskCreateRequest):
     task_id = task_manager.create_task(request)
     return {"status": "ok", "task_id": task_id}
 
+@app.post("/tasks/batch", response_model=dict, status_code=status.HTTP_200_OK)
+async def create_tasks(requests: List[TaskCreateRequest]):
+    """
+    Submit many tasks at once. The whole array is validated before any task is
+    created; the IDs are returned in the order of the array.
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="No tasks given")
+    if len(requests) > settings.max_batch_tasks:
+        raise HTTPException(status_code=400, detail=f"At most {settings.max_batch_tasks} tasks per batch")
+    task_ids = task_manager.create_tasks(requests)
+    return {"status": "ok", "task_ids": task_ids}
+
+def _check_ids(ids: List[str]) -> List[str]:
+    if len(ids) > settings.max_batch_tasks:
+        raise HTTPException(status_code=400, detail=f"At most {settings.max_batch_tasks} IDs per query")
+    return ids
+
+def _utc_iso(value: Optional[str], name: str) -> Optional[str]:
+    """Normalize an ISO time to the naive-UTC "...Z" form tasks are stamped with."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec="microseconds") + "Z"
+
+@app.get("/tasks", response_model=TaskListResponse)
+async def list_tasks(
+    ids: Optional[str] = Query(None, description="Comma-separated task IDs; other filters are ignored when given."),
+    task_status: Optional[str] = Query(None, alias="status", description="Comma-separated statuses to include."),
+    created_after: Optional[str] = Query(None, description="ISO time; tasks created at or after it."),
+    created_before: Optional[str] = Query(None, description="ISO time; tasks created before it."),
+    order: str = Query("desc", pattern="^(asc|desc)$", description="Creation time order."),
+    limit: int = Query(100, ge=1, description="Page size, capped at max_batch_tasks."),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page.")
+):
+    """
+    Look up many tasks by ID, or list them page by page, newest first by default.
+    """
+    if ids is not None:
+        tasks, missing = task_manager.get_tasks(_check_ids([t for t in ids.split(",") if t]))
+        return {"tasks": tasks, "missing": missing}
+
+    statuses = None
+    if task_status:
+        try:
+            statuses = [TaskStatus(s.strip()) for s in task_status.split(",") if s.strip()]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    created_after = _utc_iso(created_after, "created_after")
+    created_before = _utc_iso(created_before, "created_before")
+    try:
+        tasks, next_cursor = task_manager.list_tasks(
+            statuses=statuses,
+            created_after=created_after,
+            created_before=created_before,
+            limit=min(limit, settings.max_batch_tasks),
+            cursor=cursor,
+            newest_first=order == "desc"
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    return {"tasks": tasks, "next_cursor": next_cursor}
+
+@app.post("/tasks/query", response_model=TaskListResponse)
+async def query_tasks(request: TaskQueryRequest):
+    """
+    Look up many tasks by ID, for ID lists too long for a query string.
+    """
+    tasks, missing = task_manager.get_tasks(_check_ids(request.ids))
+    return {"tasks": tasks, "missing": missing}
+
 @app.get("/tasks/{task_id}", response_model=TaskResponse)
 async def get_task(task_id: str):
     """
@@ -54,6 +197,56 @@ async def get_task(task_id: str):
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
+@app.get("/tasks/{task_id}/trace")
+async def get_task_trace(task_id: str, format: str = Query("chrome", pattern="^(chrome|otlp)$")):
+    """
+    Span timeline of a recent task: Chrome trace event JSON (load in Perfetto or
+    chrome://tracing) or OTLP/JSON for an OpenTelemetry collector.
+    """
+    trace = task_manager.tracer.get(task_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace retained for this task")
+    return tracing.to_chrome(trace) if format == "chrome" else tracing.to_otlp(trace)
+
+@app.get("/traces")
+async def list_traces(limit: int = Query(50, ge=1)):
+    """
+    Tasks with a retained trace, newest first, with their span count and time span.
+    """
+    traces = []
+    for trace in task_manager.tracer.recent()[:limit]:
+        spans = trace.snapshot()
+        start = min((s.start for s in spans), default=None)
+        end = max((s.end for s in spans if s.end is not None), default=None)
+        traces.append({
+            "task_id": trace.trace_id,
+            "spans": len(spans),
+            "start": start,
+            "duration": round(end - start, 3) if start is not None and end is not None else None
+        })
+    return {"traces": traces}
+
+@app.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, request: Request):
+    """
+    Push stream of one task: its current state, then status and stage events
+    until it finishes.
+    """
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    def snapshot():
+        return task_manager.get_task(task_id) or task
+
+    def finished(event_type, data):
+        if event_type == "snapshot":
+            return data.status in _FINISHED
+        return event_type == "status" and data["status"] in _FINISHED
+
+    return StreamingResponse(_event_stream(request, f"task:{task_id}", snapshot, until=finished),
+                             media_type="text/event-stream", headers=_SSE_HEADERS)
+
 @app.delete("/tasks/{task_id}")
 async def cancel_task(task_id: str):
     """
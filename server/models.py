@@ -18,6 +18,12 @@ class TaskCreateRequest(BaseModel):
     type: TaskType = TaskType.VIDEO
     model: Optional[str] = Field(None, description="Workflow name (e.g. SeedVR2Defeat) or legacy model name")
     workflow: Optional[str] = Field(None, description="Workflow name to use. Overrides model.")
+    priority: int = Field(0, description="Scheduling priority. Higher runs first; waiting tasks gain priority over time.")
+    bypass_cache: bool = Field(False, description="Always process, even if an identical task finished or is running.")
+    fan_out: Optional[bool] = Field(None, description="Split a video into segments processed in parallel across servers. Defaults to the server setting.")
+    tile: Optional[bool] = Field(None, description="Split a large image into overlapping tiles processed in parallel across servers. Defaults to the workflow setting.")
+    tile_size: Optional[int] = Field(None, description="Tile edge in input pixels when tiling.")
+    tile_overlap: Optional[int] = Field(None, description="Overlap between neighbouring tiles in input pixels when tiling.")
     
     # Deprecated fields
     outscale: Optional[float] = Field(None, description="Deprecated. Use workflow settings.")
@@ -27,10 +33,16 @@ class TaskCreateRequest(BaseModel):
     # Deprecated but kept for compatibility (ignored in logic if not needed, or mapped if possible)
     target: Optional[str] = None 
 
+class TaskStagePhase(BaseModel):
+    name: str
+    duration: float = 0.0
+    count: int = 1
+
 class TaskStage(BaseModel):
     name: str
     status: str
     duration: float = 0.0
+    phases: List[TaskStagePhase] = Field([], description="Time spent in traced sub-phases, totalled by name.")
 
 class TaskOutput(BaseModel):
     url: Optional[str] = None
@@ -46,5 +58,13 @@ class TaskResponse(BaseModel):
     output: Optional[TaskOutput] = None
     error: Optional[str] = None
 
+class TaskQueryRequest(BaseModel):
+    ids: List[str] = Field(..., description="Task IDs to look up.")
+
+class TaskListResponse(BaseModel):
+    tasks: List[TaskResponse] = []
+    missing: List[str] = Field([], description="Requested IDs that are unknown or already evicted.")
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to get the next page; null on the last page.")
+
 class HealthResponse(BaseModel):
     status: str
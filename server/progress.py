@@ -0,0 +1,96 @@
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+
+class ProgressThrottle:
+    """
+    Wraps a (current, total) progress callback and coalesces updates.
+
+    An update is forwarded when at least min_interval seconds have passed and
+    the percentage moved by min_delta (or max_interval passed, so byte counts
+    on a slow transfer still move). Completion is always forwarded. Callers on
+    other threads that arrive while an update is being forwarded are dropped
+    rather than queued.
+    """
+    def __init__(self, callback: Callable, min_interval: float = 0.25, min_delta: float = 1.0, max_interval: float = 2.0):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.max_interval = max_interval
+        self._last_time = 0.0
+        self._last_pct = -100.0
+        self._lock = threading.Lock()
+
+    def __call__(self, current, total):
+        finished = total > 0 and current >= total
+        if not self._lock.acquire(blocking=finished):
+            return
+        try:
+            now = time.monotonic()
+            elapsed = now - self._last_time
+            pct = (current / total) * 100 if total > 0 else None
+            if not finished:
+                if elapsed < self.min_interval:
+                    return
+                moved = pct is None or abs(pct - self._last_pct) >= self.min_delta
+                if not moved and elapsed < self.max_interval:
+                    return
+            self._last_time = now
+            if pct is not None:
+                self._last_pct = pct
+        finally:
+            self._lock.release()
+        self.callback(current, total)
+
+class StageTracker:
+    """
+    The stages of one task, indexed by name and guarded by the task's own lock,
+    so progress updates never touch TaskManager.lock.
+    `stages` is the list exposed as task["stages"].
+    """
+    def __init__(self, stages: Optional[List[Dict]] = None):
+        self.lock = threading.Lock()
+        self.stages: List[Dict] = stages if stages is not None else []
+        self.index: Dict[str, Dict] = {stage["name"]: stage for stage in self.stages}
+
+    def update(self, stage_name, status, duration=0.0, progress=None, detail=None) -> Dict:
+        with self.lock:
+            stage = self.index.get(stage_name)
+            if stage is None:
+                stage = {
+                    "name": stage_name,
+                    "status": status,
+                    "duration": duration,
+                    "progress": progress if progress is not None else 0,
+                    "detail": detail if detail else ""
+                }
+                self.index[stage_name] = stage
+                self.stages.append(stage)
+                return stage
+
+            stage["status"] = status
+            if duration > 0:
+                stage["duration"] = duration
+            if progress is not None:
+                stage["progress"] = progress
+            if detail is not None:
+                stage["detail"] = detail
+            return stage
+
+    def set_phases(self, stage_name, phases: List[Dict]) -> bool:
+        """Attach sub-phase totals to a stage; False if the stage was never started."""
+        with self.lock:
+            stage = self.index.get(stage_name)
+            if stage is None:
+                return False
+            stage["phases"] = phases
+            return True
+
+    def get(self, stage_name) -> Optional[Dict]:
+        with self.lock:
+            stage = self.index.get(stage_name)
+            return dict(stage) if stage else None
+
+    def snapshot(self) -> List[Dict]:
+        with self.lock:
+            return [dict(stage) for stage in self.stages]
@@ -0,0 +1,39 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+class ResultCache:
+    """
+    LRU + TTL cache of finished task outputs keyed by input/workflow digest.
+    Values are the task "output" dicts (OSS url and size) of the task that produced them.
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key -> (stored_at, output, task_id)
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return {"output": ..., "task_id": ...} for a live entry, refreshing its LRU position."""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, output, task_id = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return {"output": dict(output), "task_id": task_id}
+
+    def put(self, key: str, output: Dict, task_id: str):
+        with self.lock:
+            self._entries[key] = (time.time(), dict(output), task_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self.lock:
+            return len(self._entries)
@@ -0,0 +1,53 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict
+
+
+class DelayedQueue:
+    """
+    Calls `callback(task_id)` once each task's delay has passed, from a single
+    timer thread. Rescheduling a task replaces its pending entry.
+    """
+    def __init__(self, callback: Callable[[str], None]):
+        self.callback = callback
+        self.heap = [] # (due, seq, task_id)
+        self.due: Dict[str, float] = {} # task_id -> due time of its live entry
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        threading.Thread(target=self._run, name="retry-timer", daemon=True).start()
+
+    def schedule(self, task_id: str, delay: float):
+        with self.cond:
+            due = time.time() + max(delay, 0.0)
+            self.due[task_id] = due
+            heapq.heappush(self.heap, (due, next(self.counter), task_id))
+            self.cond.notify()
+
+    def discard(self, task_id: str) -> bool:
+        """Forget a scheduled task; its stale heap entry is skipped when it comes up."""
+        with self.cond:
+            return self.due.pop(task_id, None) is not None
+
+    def qsize(self) -> int:
+        with self.cond:
+            return len(self.due)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    # Drop entries that were rescheduled or discarded
+                    while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+                        heapq.heappop(self.heap)
+                    now = time.time()
+                    if self.heap and self.heap[0][0] <= now:
+                        _, _, task_id = heapq.heappop(self.heap)
+                        del self.due[task_id]
+                        break
+                    self.cond.wait(timeout=self.heap[0][0] - now if self.heap else None)
+            try:
+                self.callback(task_id)
+            except Exception as e:
+                print(f"Retry timer error for {task_id}: {e}")
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+class CostEstimator:
+    """
+    Estimates GPU seconds for a task from past runs of the same workflow:
+    an EWMA of seconds per MB when the input size is known, and of plain
+    duration otherwise.
+    """
+    def __init__(self, defaults: Optional[Dict[str, float]] = None, alpha: float = 0.2):
+        self.defaults = defaults or {}
+        self.alpha = alpha
+        self.seconds_per_mb: Dict[str, float] = {}
+        self.seconds: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def _ewma(self, table, key, value):
+        previous = table.get(key)
+        table[key] = value if previous is None else previous + self.alpha * (value - previous)
+
+    def record(self, workflow: str, input_bytes: Optional[int], seconds: float):
+        with self.lock:
+            self._ewma(self.seconds, workflow, seconds)
+            if input_bytes:
+                self._ewma(self.seconds_per_mb, workflow, seconds / max(input_bytes / (1024 * 1024), 0.01))
+
+    def estimate(self, workflow: str, task_type: str, input_bytes: Optional[int] = None) -> float:
+        with self.lock:
+            if input_bytes and workflow in self.seconds_per_mb:
+                return self.seconds_per_mb[workflow] * input_bytes / (1024 * 1024)
+            if workflow in self.seconds:
+                return self.seconds[workflow]
+        return float(self.defaults.get(task_type, 60))
+
+class TaskScheduler:
+    """
+    Priority scheduler with one lane per task type or workflow.
+
+    Every entry is scored as
+        priority + aging_rate * minutes_waited - sjf_weight * estimated_minutes
+    Since all waiting entries age at the same rate, the order only depends on
+    priority - aging_rate * enqueue_minute - sjf_weight * estimated_minutes,
+    which is fixed at enqueue time and kept in a heap per lane. Aging lets a
+    low-priority or long job overtake newer, higher-priority ones after a
+    while, so nothing starves. A lane may cap how many of its tasks run at
+    once (e.g. keep one slot free of video work).
+    """
+    def __init__(self, aging_per_minute: float = 1.0, shortest_job_first: bool = True,
+                 sjf_weight_per_minute: float = 1.0, lane_limits: Optional[Dict[str, Optional[int]]] = None):
+        self.aging_per_minute = aging_per_minute
+        self.shortest_job_first = shortest_job_first
+        self.sjf_weight_per_minute = sjf_weight_per_minute
+        self.lane_limits = lane_limits or {}
+
+        self.lanes: Dict[str, List] = {}
+        self.running: Dict[str, int] = {}
+        # task_id -> lanes of its running entries; a retry may be picked up
+        # again before the previous run has called task_done
+        self.running_tasks: Dict[str, List[str]] = {}
+        self.counter = itertools.count()
+        self.size = 0
+        self.cond = threading.Condition()
+
+    def _rank(self, priority: float, enqueued_at: float, estimate: float) -> float:
+        rank = priority + self.aging_per_minute * (-enqueued_at / 60.0)
+        if self.shortest_job_first:
+            rank -= self.sjf_weight_per_minute * estimate / 60.0
+        # heapq pops the smallest, the highest rank must come first
+        return -rank
+
+    def put_many(self, entries: List[Tuple[str, str, float, float]]):
+        """Queue (task_id, lane, priority, estimate) entries under one lock acquisition."""
+        with self.cond:
+            now = time.time()
+            for task_id, lane, priority, estimate in entries:
+                entry = (self._rank(priority, now, estimate), next(self.counter), task_id)
+                heapq.heappush(self.lanes.setdefault(lane, []), entry)
+            self.size += len(entries)
+            self.cond.notify(len(entries))
+
+    def _pick_lane(self) -> Optional[str]:
+        best_lane = None
+        best_entry = None
+        for lane, heap in self.lanes.items():
+            if not heap:
+                continue
+            limit = self.lane_limits.get(lane)
+            if limit is not None and self.running.get(lane, 0) >= limit:
+                continue
+            if best_entry is None or heap[0] < best_entry:
+                best_lane, best_entry = lane, heap[0]
+        return best_lane
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Block until a task may run and return its ID (None on timeout)."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                lane = self._pick_lane()
+                if lane is not None:
+                    _, _, task_id = heapq.heappop(self.lanes[lane])
+                    self.size -= 1
+                    self.running[lane] = self.running.get(lane, 0) + 1
+                    self.running_tasks.setdefault(task_id, []).append(lane)
+                    return task_id
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def task_done(self, task_id: str):
+        """Free the lane slot taken by get()."""
+        with self.cond:
+            lanes = self.running_tasks.get(task_id)
+            if not lanes:
+                return
+            lane = lanes.pop(0)
+            if not lanes:
+                del self.running_tasks[task_id]
+            if self.running.get(lane, 0) > 0:
+                self.running[lane] -= 1
+            self.cond.notify_all()
+
+    def qsize(self) -> int:
+        return self.size
+
+    def get_status(self) -> Dict[str, Dict]:
+        with self.cond:
+            return {
+                lane: {
+                    "queued": len(self.lanes.get(lane, [])),
+                    "running": self.running.get(lane, 0),
+                    "limit": self.lane_limits.get(lane)
+                }
+                for lane in set(self.lanes) | set(self.running)
+            }
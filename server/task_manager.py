@@ -1,58 +1,229 @@
 import os
+import copy
 import time
 import uuid
+import hashlib
 import threading
 import traceback
-import requests
-import queue
 import shutil
-from datetime import datetime
-from typing import Optional
+import queue
+import random
+import requests
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor
 
 from .models import TaskCreateRequest, TaskResponse, TaskStatus, TaskStage, TaskOutput, TaskType
 from .config import settings
-from utils import OSSHandler
+from .progress import ProgressThrottle, StageTracker
+from .task_store import create_task_store
+from .result_cache import ResultCache
+from .scheduler import CostEstimator, TaskScheduler
+from .batcher import MicroBatcher
+from .retry_queue import DelayedQueue
+from .events import EventHub
+from utils import OSSHandler, RangedDownloader, workflow_registry
 from utils.comfy_pool import ComfyAPIPool
+from utils.video_split import VideoSplitter
+from utils.comfy_utils import ComfyExecutionError
+from utils.errors import InvalidTaskError, TaskCanceledError
+from utils import tiling
+from utils.metrics import Counter, GaugeFunc, Histogram, TRANSFER_BYTES
+from utils import tracing
+from PIL import Image, UnidentifiedImageError
+
+TASKS_CREATED = Counter("tmlsr_tasks_created_total", "Tasks submitted, by type.", ("type",))
+TASKS_FINISHED = Counter("tmlsr_tasks_finished_total", "Tasks that reached a final status.", ("status",))
+QUEUE_WAIT_SECONDS = Histogram("tmlsr_queue_wait_seconds", "Time from (re)queueing to a download worker taking the task, by lane.",
+                               ("lane",))
+STAGE_SECONDS = Histogram("tmlsr_stage_seconds", "Duration of completed download, process and upload stages.",
+                          ("stage", "workflow"))
+RETRIES = Counter("tmlsr_task_retries_total", "Retries scheduled, by failure reason.", ("reason",))
+FAILURES = Counter("tmlsr_task_failures_total", "Tasks failed for good, by failure reason.", ("reason",))
 
 class TaskManager:
     def __init__(self):
         self.tasks = {} # In-memory storage: task_id -> dict
-        self.queue = queue.Queue()
+        self.stage_trackers = {} # task_id -> StageTracker, each with its own lock
         self.lock = threading.Lock()
+
+        # Pending tasks wait in the scheduler, ordered by lane, priority, age and estimated cost
+        scheduler_config = settings.scheduler_config
+        self.estimator = CostEstimator(defaults=scheduler_config.get("default_estimate_seconds", {"image": 10, "video": 600}))
+        self.scheduler = TaskScheduler(
+            aging_per_minute=scheduler_config.get("aging_per_minute", 1.0),
+            shortest_job_first=scheduler_config.get("shortest_job_first", True),
+            sjf_weight_per_minute=scheduler_config.get("sjf_weight_per_minute", 1.0),
+            lane_limits={lane: cfg.get("max_running") for lane, cfg in scheduler_config.get("lanes", {}).items()}
+        )
+
+        # Monitor bookkeeping, maintained on every status transition under self.lock
+        self.status_counts = {s: 0 for s in TaskStatus}
+        self.recent_task_ids = deque(maxlen=settings.monitor_recent_tasks)
+        self.finished_tasks = OrderedDict() # task_id -> finish time, oldest first, for eviction
+        # Push streams: status and stage changes go to "task:<id>" and "monitor"
+        self.events = EventHub(buffer_size=settings.event_buffer_size)
+        # Span timelines of recent tasks, exported per task at /tasks/{id}/trace
+        tracing_config = settings.tracing_config
+        self.tracer = tracing.Tracer(max_traces=tracing_config.get("max_traces", 200),
+                                     max_spans=tracing_config.get("max_spans_per_trace", 5000),
+                                     enabled=tracing_config.get("enabled", True))
         
-        # Use server count as concurrency limit as requested
-        self.max_workers = len(settings.comfyui_servers)
-        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Staged pipeline: download, GPU and upload workers are sized independently and
+        # connected by bounded queues, so a ComfyUI server is only claimed once the input
+        # is local and is free again as soon as the outputs are fetched.
+        # One GPU worker per server slot (prompts a server may hold at once)
+        self.max_workers = len(settings.comfyui_servers) * max(1, settings.comfyui_inflight_per_server)
+        self.download_workers = settings.download_workers
+        self.upload_workers = settings.upload_workers
+        self.ready_queue = queue.Queue(maxsize=settings.pipeline_buffer or 2 * self.max_workers)
+        self.upload_queue = queue.Queue(maxsize=settings.upload_buffer or 2 * self.upload_workers)
+        self.stage_active = {"download": 0, "process": 0, "upload": 0}
+        self.queued_at = {} # task_id -> (time queued, lane), for the queue wait metric
+        # Failed tasks wait here for their backoff before resuming
+        self.retry_queue = DelayedQueue(self._resume_task)
+        # Small images of the same workflow can share one prompt; the batcher
+        # holds them back for at most max_wait_ms before they go to the GPU stage
+        batching = settings.batching_config
+        self.batcher = None
+        if batching.get("enabled", False):
+            self.batcher = MicroBatcher(self.ready_queue.put, max_batch=batching.get("max_batch", 8),
+                                        max_wait=batching.get("max_wait_ms", 200) / 1000.0)
         
         self.oss_handler = OSSHandler()
-        self.comfy_pool = ComfyAPIPool(settings.comfyui_servers)
-        
-        # Start worker thread
-        self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
-        self.worker_thread.start()
+        download_config = settings.download_config
+        self.downloader = RangedDownloader(
+            threads=download_config.get("threads", 4),
+            part_size=int(download_config.get("part_size_mb", 16) * 1024 * 1024),
+            chunk_size=int(download_config.get("chunk_size_kb", 1024) * 1024),
+            min_parallel_size=int(download_config.get("min_parallel_size_mb", 32) * 1024 * 1024),
+            retries=download_config.get("range_retries", 3)
+        )
+        fanout_config = settings.fanout_config
+        self.video_splitter = VideoSplitter(ffmpeg=fanout_config.get("ffmpeg", "ffmpeg"),
+                                            ffprobe=fanout_config.get("ffprobe", "ffprobe"))
+        self.comfy_pool = ComfyAPIPool(settings.comfyui_servers, health_config=settings.comfyui_health,
+                                       affinity_config=settings.comfyui_affinity,
+                                       inflight_per_server=settings.comfyui_inflight_per_server,
+                                       execution_timeout=settings.comfyui_execution_timeout,
+                                       queue_timeout=settings.comfyui_queue_timeout)
+        # Spare GPU workers for tasks the pool lets wait for a server with their
+        # workflow loaded, so the ready tasks behind them can still take free slots
+        self.gpu_workers = self.max_workers + self.comfy_pool.affinity_max_waiters
+
+        # Result reuse: finished outputs by input/workflow key, and the task
+        # currently producing each key with the tasks waiting on it
+        cache_config = settings.cache_config
+        self.result_cache = ResultCache(
+            max_entries=cache_config.get("max_entries", 10000),
+            ttl=cache_config.get("ttl_seconds", 24 * 3600)
+        )
+        self.cancel_events = {} # task_id -> threading.Event, set when the task is canceled
+        self.inflight = {}   # cache key -> leader task_id
+        self.followers = {}  # leader task_id -> [task_id]
+
+        # Restore persisted tasks before touching temp files, so recovered tasks keep theirs
+        self.store = create_task_store(settings.store_config)
+        recovered = self._restore_tasks()
+        self._cleanup_stale_files(keep={self.tasks[t]["temp_dir"] for t in recovered})
+        self.store.start(self._snapshot_task)
         
-        self._cleanup_stale_files()
+        self._register_metrics()
+        self._start_pipeline()
+        threading.Thread(target=self._monitor_events_loop, name="monitor-events", daemon=True).start()
         
-        print(f"TaskManager initialized with {self.max_workers} concurrent workers.")
+        print(f"TaskManager initialized with {self.download_workers} download, {self.gpu_workers} GPU and "
+              f"{self.upload_workers} upload workers, {len(recovered)} recovered tasks.")
+
+    def _restore_tasks(self):
+        """
+        Load persisted tasks into memory. Unfinished tasks are reset to pending
+        and re-queued in creation order. Returns the re-queued task IDs.
+        """
+        records = self.store.load()
+        recovered = []
+        finished = []
+        with self.lock:
+            for data in records:
+                task_id = data["task_id"]
+                data["status"] = TaskStatus(data["status"])
+                tracker = StageTracker(data.get("stages") or [])
+                data["stages"] = tracker.stages
+                self.tasks[task_id] = data
+                self.stage_trackers[task_id] = tracker
+                self.cancel_events[task_id] = threading.Event()
+                self.recent_task_ids.append(task_id)
+
+                if data["status"] in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED):
+                    finished.append((self._parse_time(data["updated_at"]), task_id))
+                else:
+                    # Whatever was running died with the previous process
+                    data["status"] = TaskStatus.PENDING
+                    self.store.mark_dirty(task_id)
+                    recovered.append(task_id)
+                self.status_counts[data["status"]] += 1
+
+            for finished_at, task_id in sorted(finished):
+                self.finished_tasks[task_id] = finished_at
+            self._evict_finished_tasks()
+
+        for task_id in recovered:
+            self._enqueue(self.tasks[task_id])
+        return recovered
 
-    def _cleanup_stale_files(self):
-        """Clean up stale temporary files from previous runs."""
+    @staticmethod
+    def _parse_time(iso_str):
+        return datetime.fromisoformat(iso_str.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+    def _snapshot_task(self, task_id):
+        """Serializable copy of a task for the store, or None if it is gone."""
+        with self.lock:
+            data = self.tasks.get(task_id)
+            if data is None:
+                return None
+            data = dict(data)
+            # Workers add to artifacts while a task runs; serialize a stable copy
+            data["artifacts"] = copy.deepcopy(data.get("artifacts") or {})
+        tracker = self.stage_trackers.get(task_id)
+        data["stages"] = tracker.snapshot() if tracker else []
+        return data
+
+    def shutdown(self):
+        """Close event streams and flush pending task writes; called on application shutdown."""
+        self.events.close()
+        self.store.close()
+
+    def _cleanup_stale_files(self, keep=frozenset()):
+        """
+        Clean up stale temporary files from previous runs.
+        Task directories listed in `keep` (recovered tasks) are left in place.
+        """
         print("Cleaning up stale temporary files...")
+        keep = {os.path.normpath(d) for d in keep}
         
         # 1. Clean temp_tasks directory
         if os.path.exists("temp_tasks"):
-            try:
-                shutil.rmtree("temp_tasks")
-                print("Removed stale 'temp_tasks' directory.")
-            except Exception as e:
-                print(f"Failed to remove 'temp_tasks': {e}")
+            for name in os.listdir("temp_tasks"):
+                path = os.path.join("temp_tasks", name)
+                if os.path.normpath(path) in keep:
+                    continue
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except Exception as e:
+                    print(f"Failed to remove '{path}': {e}")
+            print("Removed stale task files from 'temp_tasks'.")
                 
         # 2. Clean VideoSRProcessor temp directories (temp_*)
         # Look for directories matching temp_* in the current directory
         # Be careful not to delete other temp folders if any
         import glob
         for temp_dir in glob.glob("temp_*"):
+            if temp_dir == "temp_tasks":
+                continue
             if os.path.isdir(temp_dir):
                 # Double check it looks like one of our temp dirs
                 # VideoSRProcessor: temp_{video_name}_{timestamp}
@@ -65,71 +236,247 @@ class TaskManager:
                     print(f"Failed to remove '{temp_dir}': {e}")
 
     def create_task(self, request: TaskCreateRequest) -> str:
-        task_id = str(uuid.uuid4()).replace('-', '')
-        now = datetime.utcnow().isoformat() + "Z"
-        
-        task_data = {
-            "task_id": task_id,
-            "status": TaskStatus.PENDING,
-            "created_at": now,
-            "updated_at": now,
-            "params": request.model_dump(),
-            "stages": [],
-            "output": None,
-            "error": None,
-            "retries": 0,
-            "temp_dir": os.path.join("temp_tasks", task_id)
-        }
+        return self.create_tasks([request])[0]
+
+    def create_tasks(self, task_requests: List[TaskCreateRequest]) -> List[str]:
+        """Create and queue tasks in order, taking the task and scheduler locks once."""
+        now = datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+        created = []
+        for request in task_requests:
+            task_id = str(uuid.uuid4()).replace('-', '')
+            tracker = StageTracker()
+            task_data = {
+                "task_id": task_id,
+                "status": TaskStatus.PENDING,
+                "created_at": now,
+                "updated_at": now,
+                "params": request.model_dump(),
+                "stages": tracker.stages,
+                "output": None,
+                "error": None,
+                "retries": 0,
+                "temp_dir": os.path.join("temp_tasks", task_id)
+            }
+            created.append((task_data, tracker))
         
         with self.lock:
-            self.tasks[task_id] = task_data
+            for task_data, tracker in created:
+                task_id = task_data["task_id"]
+                self.tasks[task_id] = task_data
+                self.stage_trackers[task_id] = tracker
+                self.cancel_events[task_id] = threading.Event()
+                self.recent_task_ids.append(task_id)
+            self.status_counts[TaskStatus.PENDING] += len(created)
+            self._evict_finished_tasks()
+        for task_data, _ in created:
+            self.store.mark_dirty(task_data["task_id"])
+            TASKS_CREATED.inc(getattr(task_data["params"]["type"], "value", task_data["params"]["type"]))
+            if self.events.has_subscribers("monitor"):
+                self.events.publish("monitor", "task", {**task_data, "stages": []})
             
-        self.queue.put(task_id)
-        return task_id
+        self._schedule([task_data for task_data, _ in created])
+        return [task_data["task_id"] for task_data, _ in created]
 
     def get_task(self, task_id: str) -> Optional[TaskResponse]:
         with self.lock:
             data = self.tasks.get(task_id)
             if not data:
                 return None
-            return TaskResponse(**data)
+            data = dict(data)
+        data["stages"] = self.stage_trackers[task_id].snapshot()
+        return TaskResponse(**data)
+
+    def get_tasks(self, task_ids: List[str]) -> Tuple[List[TaskResponse], List[str]]:
+        """The tasks among `task_ids` in the given order, and the IDs that are unknown."""
+        with self.lock:
+            found = [dict(self.tasks[t]) for t in task_ids if t in self.tasks]
+            missing = [t for t in task_ids if t not in self.tasks]
+        return self._responses(found), missing
+
+    def list_tasks(self, statuses=None, created_after=None, created_before=None, limit=100,
+                   cursor=None, newest_first=True) -> Tuple[List[TaskResponse], Optional[str]]:
+        """
+        One page of tasks ordered by creation time, optionally filtered by status
+        and a created_at range (ISO strings). Returns the page and the cursor of
+        the next one, or None on the last page.
+        """
+        # Compared as times, not strings: isoformat() drops a zero microsecond part,
+        # so records stamped before timespec was fixed have mixed precision
+        def key(task):
+            return self._parse_time(task["created_at"]), task["task_id"]
+
+        position = None
+        if cursor:
+            created_at, _, task_id = cursor.partition("/")
+            position = (self._parse_time(created_at), task_id)
+        after = self._parse_time(created_after) if created_after else None
+        before = self._parse_time(created_before) if created_before else None
+        with self.lock:
+            matched = [
+                task for task in self.tasks.values()
+                if (not statuses or task["status"] in statuses)
+                and (after is None or self._parse_time(task["created_at"]) >= after)
+                and (before is None or self._parse_time(task["created_at"]) < before)
+            ]
+        # task IDs break ties between tasks created in the same microsecond, e.g. one batch
+        matched.sort(key=key, reverse=newest_first)
+        if position is not None:
+            matched = [task for task in matched if (key(task) < position if newest_first else key(task) > position)]
+        page = [dict(task) for task in matched[:limit]]
+        next_cursor = None
+        if len(matched) > limit:
+            next_cursor = f"{page[-1]['created_at']}/{page[-1]['task_id']}"
+        return self._responses(page), next_cursor
+
+    def _responses(self, tasks) -> List[TaskResponse]:
+        """TaskResponse models of task record copies, with their stages."""
+        responses = []
+        for data in tasks:
+            tracker = self.stage_trackers.get(data["task_id"])
+            data["stages"] = tracker.snapshot() if tracker else data["stages"]
+            responses.append(TaskResponse(**data))
+        return responses
 
     def get_monitor_stats(self):
         with self.lock:
-            total_tasks = len(self.tasks)
-            status_counts = {
-                TaskStatus.PENDING: 0,
-                TaskStatus.PROCESSING: 0,
-                TaskStatus.COMPLETED: 0,
-                TaskStatus.FAILED: 0,
-                TaskStatus.CANCELED: 0
-            }
-            
-            # Sort tasks by created_at desc
-            sorted_tasks = sorted(
-                self.tasks.values(), 
-                key=lambda x: x.get("created_at", ""), 
-                reverse=True
-            )
-            
-            for task in sorted_tasks:
-                s = task.get("status")
-                if s in status_counts:
-                    status_counts[s] += 1
-            
-            # Return top 50 recent tasks for dashboard
-            recent_tasks = sorted_tasks[:50]
-            
-            return {
-                "system": {
-                    "max_workers": self.max_workers,
-                    "active_workers": status_counts[TaskStatus.PROCESSING], # Approximation
-                    "queue_size": self.queue.qsize()
-                },
-                "pool_status": self.comfy_pool.get_status(),
-                "stats": status_counts,
-                "tasks": recent_tasks
-            }
+            self._evict_finished_tasks()
+            # Most recent tasks first, skipping any that were already evicted
+            recent_tasks = []
+            for task_id in reversed(self.recent_task_ids):
+                task = self.tasks.get(task_id)
+                if task is not None:
+                    recent_tasks.append(task)
+        
+        recent_tasks = [
+            {**task, "stages": self.stage_trackers[task["task_id"]].snapshot()}
+            for task in recent_tasks
+            if task["task_id"] in self.stage_trackers
+        ]
+        
+        return {
+            **self._monitor_summary(),
+            "pool_status": self.comfy_pool.get_status(),
+            "tasks": recent_tasks
+        }
+
+    def _monitor_summary(self):
+        """Worker, pipeline and status counters of the monitor view, without the task list."""
+        with self.lock:
+            status_counts = dict(self.status_counts)
+            stage_active = dict(self.stage_active)
+        return {
+            "system": {
+                "max_workers": self.max_workers,
+                "active_workers": stage_active["process"],
+                "queue_size": self.scheduler.qsize()
+            },
+            "pipeline": {
+                "downloading": stage_active["download"],
+                "batching": self.batcher.qsize() if self.batcher else 0,
+                "ready": self.ready_queue.qsize(),
+                "processing": stage_active["process"],
+                "uploading": stage_active["upload"],
+                "upload_queue": self.upload_queue.qsize(),
+                "retry_waiting": self.retry_queue.qsize()
+            },
+            "lanes": self.scheduler.get_status(),
+            "stats": status_counts
+        }
+
+    def _monitor_events_loop(self):
+        """
+        Publish pool status and the counters to /monitor/events when they change.
+        One snapshot per interval serves every dashboard, and none is taken while
+        nobody is watching.
+        """
+        last_summary = last_pool = None
+        while True:
+            time.sleep(settings.monitor_event_interval)
+            if not self.events.has_subscribers("monitor"):
+                last_summary = last_pool = None
+                continue
+            try:
+                summary = self._monitor_summary()
+                pool = self.comfy_pool.get_status()
+            except Exception as e:
+                print(f"Monitor events error: {e}")
+                continue
+            if summary != last_summary:
+                self.events.publish("monitor", "summary", summary, key="summary")
+                last_summary = summary
+            # Probe time and latency move with every health probe; only publish real changes
+            pool_state = [
+                {**server, "health": {k: v for k, v in server["health"].items() if k not in ("last_probe", "latency_ms")}}
+                for server in pool
+            ]
+            if pool_state != last_pool:
+                self.events.publish("monitor", "pool", pool, key="pool")
+                last_pool = pool_state
+
+    def _register_metrics(self):
+        """Gauges for /metrics, read from the figures the monitor view already keeps."""
+        def pipeline():
+            summary = self._monitor_summary()
+            counts = {(stage,): value for stage, value in summary["pipeline"].items()}
+            counts[("queued",)] = summary["system"]["queue_size"]
+            return counts
+
+        def statuses():
+            with self.lock:
+                return {(status.value,): count for status, count in self.status_counts.items()}
+
+        workers = {("download",): self.download_workers, ("gpu",): self.gpu_workers, ("upload",): self.upload_workers}
+        GaugeFunc("tmlsr_pipeline_tasks", "Tasks in each pipeline stage or queue.", ("stage",), pipeline)
+        GaugeFunc("tmlsr_tasks", "Tasks held in memory, by status.", ("status",), statuses)
+        GaugeFunc("tmlsr_workers", "Worker threads per pipeline stage.", ("stage",), lambda: workers)
+
+    def _publish_task_event(self, task_id, event_type, data, key=None):
+        for topic in (f"task:{task_id}", "monitor"):
+            if self.events.has_subscribers(topic):
+                self.events.publish(topic, event_type, data, key=key)
+
+    def _set_status(self, task, status):
+        """Move a task to a new status. Caller must hold self.lock."""
+        previous = task["status"]
+        task["status"] = status
+        task["updated_at"] = datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+        self.store.mark_dirty(task["task_id"])
+        if previous == status:
+            return
+        self._publish_task_event(task["task_id"], "status", {
+            "task_id": task["task_id"],
+            "status": status,
+            "updated_at": task["updated_at"],
+            "retries": task.get("retries", 0),
+            "error": task.get("error"),
+            "output": task.get("output")
+        })
+        self.status_counts[previous] -= 1
+        self.status_counts[status] += 1
+        if status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED):
+            TASKS_FINISHED.inc(status.value)
+            self.finished_tasks[task["task_id"]] = time.time()
+            self._evict_finished_tasks()
+
+    def _evict_finished_tasks(self):
+        """
+        Drop finished tasks beyond the retention policy. Caller must hold self.lock.
+        finished_tasks is ordered by finish time, so only expired entries are visited.
+        """
+        ttl = settings.task_ttl_seconds
+        max_finished = settings.max_finished_tasks
+        now = time.time()
+        while self.finished_tasks:
+            task_id, finished_at = next(iter(self.finished_tasks.items()))
+            if len(self.finished_tasks) <= max_finished and now - finished_at <= ttl:
+                break
+            del self.finished_tasks[task_id]
+            task = self.tasks.pop(task_id, None)
+            self.stage_trackers.pop(task_id, None)
+            self.cancel_events.pop(task_id, None)
+            self.store.mark_deleted(task_id)
+            if task is not None:
+                self.status_counts[task["status"]] -= 1
 
     def cancel_task(self, task_id: str) -> bool:
         with self.lock:
@@ -139,101 +486,372 @@ class TaskManager:
             if task["status"] in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELED]:
                 return False
             
-            task["status"] = TaskStatus.CANCELED
-            task["updated_at"] = datetime.utcnow().isoformat() + "Z"
-            # Note: This doesn't stop a running thread immediately, 
-            # but the worker loop checks status before processing.
-            return True
+            self._set_status(task, TaskStatus.CANCELED)
+            cancel_event = self.cancel_events.get(task_id)
+            # A task waiting on an identical in-flight task is only in its leader's list
+            attached = False
+            for followers in self.followers.values():
+                if task_id in followers:
+                    followers.remove(task_id)
+                    attached = True
+                    break
 
-    def _worker_loop(self):
+        # Running transfers and prompts watch this event and stop within a second,
+        # releasing their pool slot; the worker then cleans up the task's files
+        if cancel_event is not None:
+            cancel_event.set()
+        # A task waiting for its retry or attached to another has no worker to do that.
+        # Its own cache keys may have followers too, which are re-queued here
+        if self.retry_queue.discard(task_id) or attached:
+            if attached:
+                self._update_stage(task_id, "cache", "canceled", detail="Canceled while waiting for an identical task")
+            self._resolve_followers(task_id, None)
+            self._cleanup_task_files(task)
+        return True
+
+    def _start_pipeline(self):
+        """Start the download, GPU and upload workers."""
+        stages = [
+            ("download", self.download_workers, self._download_loop),
+            ("gpu", self.gpu_workers, self._gpu_loop),
+            ("upload", self.upload_workers, self._upload_loop),
+        ]
+        for name, count, target in stages:
+            for i in range(count):
+                threading.Thread(target=target, name=f"{name}-worker-{i}", daemon=True).start()
+
+    def _download_loop(self):
+        while True:
+            try:
+                task_id = self.scheduler.get()
+                queued = self.queued_at.pop(task_id, None)
+                if queued:
+                    QUEUE_WAIT_SECONDS.observe(time.time() - queued[0], queued[1])
+                    tracing.record_in(self.tracer.trace(task_id), "queue", queued[0], time.time(), lane=queued[1])
+                if self._run_stage(task_id, "download", self._stage_download):
+                    self._dispatch_ready(task_id)
+                else:
+                    self.scheduler.task_done(task_id)
+            except Exception as e:
+                print(f"Download worker error: {e}")
+
+    def _gpu_loop(self):
         while True:
             try:
-                task_id = self.queue.get()
-                # Submit task to thread pool for concurrent execution
-                self.executor.submit(self._run_task_async, task_id)
+                task_id = self.ready_queue.get()
+                if isinstance(task_id, list):
+                    self._run_batch(task_id)
+                    continue
+                try:
+                    uploadable = self._run_stage(task_id, "process", self._stage_process)
+                finally:
+                    # The task no longer counts against its lane once it is off the GPU
+                    self.scheduler.task_done(task_id)
+                if uploadable:
+                    self.upload_queue.put(task_id)
             except Exception as e:
-                print(f"Worker loop error: {e}")
+                print(f"GPU worker error: {e}")
 
-    def _run_task_async(self, task_id):
-        """Wrapper to run task and mark queue item as done."""
+    def _dispatch_ready(self, task_id):
+        """Hand a task with its input in place to the GPU stage, through the batcher if it qualifies."""
         try:
-            self._process_task_wrapper(task_id)
+            key = self._batch_key(task_id)
         except Exception as e:
-            print(f"Async task execution error for {task_id}: {e}")
+            print(f"Cannot batch task {task_id}: {e}")
+            key = None
+        if key is not None:
+            self.batcher.add(key, task_id)
+        else:
+            # Blocks while the GPU stage is backed up, so inputs don't pile up on disk
+            self.ready_queue.put(task_id)
+
+    def _batch_key(self, task_id):
+        """Key shared by tasks that may run in one prompt, or None if the task runs alone."""
+        if self.batcher is None:
+            return None
+        batching = settings.batching_config
+        task = self.tasks[task_id]
+        if task.get("unbatchable"):
+            return None
+        params = task["params"]
+        workflow = self._workflow_key(self._resolve_workflow_name(params))
+        task_type = getattr(params.get("type"), "value", params.get("type"))
+        workflows = batching.get("workflows") or []
+        if task_type != TaskType.IMAGE.value or params.get("tile") or (workflows and workflow not in workflows):
+            return None
+        if self._stage_done(self.stage_trackers[task_id], "process"):
+            return None
+        with Image.open(task["artifacts"]["input"]) as img:
+            pixels = img.size[0] * img.size[1]
+        if pixels > batching.get("max_pixels", 1024 * 1024):
+            return None
+        # Images within a factor of two in pixel count batch together
+        return (workflow, pixels.bit_length())
+
+    def _run_batch(self, task_ids):
+        """GPU stage for a micro-batch: one prompt for all tasks, outputs split back per task."""
+        active = []
+        for task_id in task_ids:
+            with self.lock:
+                task = self.tasks.get(task_id)
+                canceled = bool(task) and task["status"] == TaskStatus.CANCELED
+                if task and not canceled:
+                    self._set_status(task, TaskStatus.PROCESSING)
+                    self.stage_active["process"] += 1
+                    active.append(task_id)
+            if canceled:
+                self._resolve_followers(task_id, None)
+                self._cleanup_task_files(task)
+            if task_id not in active:
+                self.scheduler.task_done(task_id)
+        if not active:
+            return
+
+        workflow_name = self._resolve_workflow_name(self.tasks[active[0]]["params"])
+        start_time = time.time()
+        try:
+            workflow_path = self._workflow_path(workflow_name)
+            for task_id in active:
+                self._update_stage(task_id, "process", "running", progress=0, detail=f"Processing with {workflow_name} (batch of {len(active)})...")
+
+            def batch_progress(current, total):
+                if total > 0:
+                    pct = round((current / total) * 100, 1)
+                    for task_id in active:
+                        self._update_stage(task_id, "process", "running", progress=pct, detail=f"Executing nodes {int(current)}/{total} (batch of {len(active)})")
+
+            with tracing.span("process", traces=[self.tracer.trace(t) for t in active], batch=len(active)) as group:
+                results = self.comfy_pool.process_batch(workflow_path,
+                                                        [self.tasks[t]["artifacts"]["input"] for t in active],
+                                                        [self.tasks[t]["temp_dir"] for t in active],
+                                                        active, progress_callback=self._throttled(batch_progress),
+                                                        cancel_events=[self.cancel_events.get(t) or threading.Event() for t in active])
+            self._record_phases(group)
+        except Exception as e:
+            results = [e] * len(active)
         finally:
-            self.queue.task_done()
+            with self.lock:
+                self.stage_active["process"] -= len(active)
+            for task_id in active:
+                self.scheduler.task_done(task_id)
 
-    def _process_task_wrapper(self, task_id):
-        # Check if canceled
+        duration = time.time() - start_time
+        for task_id, outputs in zip(active, results):
+            with self.lock:
+                canceled = self.tasks[task_id]["status"] == TaskStatus.CANCELED
+            if canceled:
+                # Its outputs were not fetched; clean up like any stage interrupted by a cancel
+                self._handle_failure(task_id, TaskCanceledError("Canceled during batch"))
+                continue
+            if isinstance(outputs, Exception) or not outputs:
+                error = outputs if isinstance(outputs, Exception) else RuntimeError("Workflow produced no output files")
+                if len(active) > 1:
+                    self._run_alone(task_id, error)
+                else:
+                    self._handle_failure(task_id, error)
+                continue
+            artifacts = self.tasks[task_id]["artifacts"]
+            artifacts["outputs"] = outputs
+            self.estimator.record(self._workflow_key(workflow_name), os.path.getsize(artifacts["input"]), duration / len(active))
+            STAGE_SECONDS.observe(duration, "process", self._workflow_key(workflow_name))
+            self._update_stage(task_id, "process", "success", duration=duration, progress=100, detail=f"Processing complete (batch of {len(active)})")
+            self.upload_queue.put(task_id)
+
+    def _run_alone(self, task_id, error):
+        """
+        Send a task of a failed batch back through the single-task path. One bad
+        input fails the whole prompt, so only a failure on its own counts.
+        """
+        print(f"Batch failed for task {task_id} ({error}), retrying it alone")
         with self.lock:
             task = self.tasks.get(task_id)
-            if not task or task["status"] == TaskStatus.CANCELED:
+            if not task:
                 return
+            task["unbatchable"] = True
+            self.store.mark_dirty(task_id)
+        self._update_stage(task_id, "process", "pending", progress=0, detail="Batch failed, retrying alone")
+        try:
+            self.ready_queue.put_nowait(task_id)
+        except queue.Full:
+            # GPU workers drain this queue, so they must not block on it; run it here instead
+            if self._run_stage(task_id, "process", self._stage_process):
+                self.upload_queue.put(task_id)
 
-            task["status"] = TaskStatus.PROCESSING
-            task["updated_at"] = datetime.utcnow().isoformat() + "Z"
+    def _upload_loop(self):
+        while True:
+            try:
+                task_id = self.upload_queue.get()
+                if self._run_stage(task_id, "upload", self._stage_upload):
+                    self._complete_task(task_id)
+            except Exception as e:
+                print(f"Upload worker error: {e}")
 
+    def _run_stage(self, task_id, stage_name, stage_fn):
+        """
+        Run one pipeline stage of a task. Returns True when the task moves on to
+        the next stage; failures, retries and cancellation are handled here.
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            canceled = bool(task) and task["status"] == TaskStatus.CANCELED
+            if task and not canceled:
+                self._set_status(task, TaskStatus.PROCESSING)
+                self.stage_active[stage_name] += 1
+        if not task:
+            return False
+        if canceled:
+            # A canceled retry may still own cache keys with tasks waiting on it
+            self._resolve_followers(task_id, None)
+            self._cleanup_task_files(task)
+            return False
+
+        start_time = time.time()
+        group = None
         try:
-            self._execute_task(task_id)
-            with self.lock:
-                self.tasks[task_id]["status"] = TaskStatus.COMPLETED
-                self.tasks[task_id]["updated_at"] = datetime.utcnow().isoformat() + "Z"
+            with tracing.span(stage_name, traces=[self.tracer.trace(task_id)], attempt=task["retries"] + 1) as group:
+                advance = stage_fn(task_id)
         except Exception as e:
-                print(f"Task {task_id} failed: {e}")
-                traceback.print_exc()
-                
-                with self.lock:
-                    task = self.tasks[task_id]
-                    task["retries"] += 1
-                    if task["retries"] <= settings.max_retries:
-                        print(f"Retrying task {task_id} ({task['retries']}/{settings.max_retries})...")
-                        task["status"] = TaskStatus.PENDING # Reset to pending
-                        task["error"] = f"Retry {task['retries']}: {str(e)}"
-                        # Re-queue after delay (blocking this thread briefly is okay if we have enough workers, 
-                        # but ideally use a scheduled executor. For simplicity, just push back.)
-                        self.queue.put(task_id)
-                    else:
-                        task["status"] = TaskStatus.FAILED
-                        task["error"] = str(e)
-                        task["updated_at"] = datetime.utcnow().isoformat() + "Z"
+            self._handle_failure(task_id, e)
+            return False
+        finally:
+            with self.lock:
+                self.stage_active[stage_name] -= 1
+            self._record_phases(group)
+        if advance:
+            STAGE_SECONDS.observe(time.time() - start_time, stage_name, self._task_workflow(task))
+        if not advance:
+            # Finished from the cache, or attached to an identical in-flight task
+            self._cleanup_task_files(task)
+        return advance
 
-    def _update_stage(self, task_id, stage_name, status, duration=0.0, progress=None, detail=None):
-        # Round duration to 2 decimal places for cleaner output
-        duration = round(duration, 2)
-        
+    def _complete_task(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return
+            # A task canceled during its last stage stays canceled
+            if task["status"] != TaskStatus.CANCELED:
+                self._set_status(task, TaskStatus.COMPLETED)
+            output = task["output"] if task["status"] == TaskStatus.COMPLETED else None
+        self._resolve_followers(task_id, output)
+        self._cleanup_task_files(task)
+
+    def _handle_failure(self, task_id, e):
+        with self.lock:
+            canceled = self.tasks[task_id]["status"] == TaskStatus.CANCELED
+        if canceled:
+            print(f"Task {task_id} stopped: canceled")
+            self._resolve_followers(task_id, None)
+            self._cleanup_task_files(self.tasks[task_id])
+            return
+
+        print(f"Task {task_id} failed: {e}")
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+        retryable = self._is_retryable(e)
+        reason = self._failure_reason(e)
         with self.lock:
             task = self.tasks[task_id]
-            # Check if stage exists, update it, or append
-            found = False
-            for stage in task["stages"]:
-                if stage["name"] == stage_name:
-                    stage["status"] = status
-                    if duration > 0:
-                        stage["duration"] = duration
-                    if progress is not None:
-                        stage["progress"] = progress
-                    if detail is not None:
-                        stage["detail"] = detail
-                    found = True
-                    break
-            if not found:
-                task["stages"].append({
-                    "name": stage_name,
-                    "status": status,
-                    "duration": duration,
-                    "progress": progress if progress is not None else 0,
-                    "detail": detail if detail else ""
-                })
-
-    def _execute_task(self, task_id):
-        task = self.tasks[task_id]
-        params = task["params"]
+            task["retries"] += 1
+            if retryable and task["retries"] <= settings.max_retries:
+                RETRIES.inc(reason)
+                delay = self._retry_delay(task["retries"])
+                print(f"Retrying task {task_id} ({task['retries']}/{settings.max_retries}) in {delay:.1f}s...")
+                task["error"] = f"Retry {task['retries']}: {str(e)}"
+                self._set_status(task, TaskStatus.PENDING) # Reset to pending
+            else:
+                FAILURES.inc(reason)
+                task["error"] = str(e) if retryable else f"Not retryable: {e}"
+                self._set_status(task, TaskStatus.FAILED)
+        if task["status"] == TaskStatus.FAILED:
+            self._cleanup_task_files(task)
+            self._resolve_followers(task_id, None)
+        else:
+            # Files of finished stages are kept, so the retry resumes at the stage that failed
+            self.retry_queue.schedule(task_id, delay)
+
+    @staticmethod
+    def _retry_delay(attempt):
+        """Exponential backoff from retry_delay, capped, with jitter so failed batches don't retry in lockstep."""
+        delay = min(settings.retry_delay * 2 ** (attempt - 1), settings.retry_max_delay)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def _is_retryable(e):
+        """False for errors that would repeat on every attempt: bad input, missing workflow, rejected request."""
+        # Not ValueError at large: a garbled JSON reply from ComfyUI or a proxy is one too
+        if isinstance(e, (FileNotFoundError, InvalidTaskError, UnidentifiedImageError, TaskCanceledError)):
+            return False
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            status = e.response.status_code
+            return status >= 500 or status in (408, 429)
+        if isinstance(e, ComfyExecutionError):
+            # Running out of memory may pass on a less loaded server, and an interrupted
+            # prompt (no exception) says nothing about the input; other node errors do
+            return not e.data.get("exception_message") or TaskManager._is_oom(e)
+        return True
+
+    @staticmethod
+    def _is_oom(e):
+        message = f"{e.data.get('exception_type', '')} {e.data.get('exception_message', '')}".lower()
+        return "out of memory" in message or "outofmemory" in message
+
+    @staticmethod
+    def _failure_reason(e):
+        """A short label from a small fixed set, for the retry and failure metrics."""
+        if isinstance(e, TaskCanceledError):
+            return "canceled"
+        if isinstance(e, ComfyExecutionError):
+            if not e.data.get("exception_message"):
+                return "comfyui_interrupted"
+            return "comfyui_oom" if TaskManager._is_oom(e) else "comfyui_error"
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            return f"http_{e.response.status_code}"
+        if isinstance(e, (requests.Timeout, TimeoutError)):
+            return "timeout"
+        if isinstance(e, (requests.ConnectionError, ConnectionError)):
+            return "connection"
+        if isinstance(e, FileNotFoundError):
+            return "not_found"
+        if isinstance(e, (InvalidTaskError, UnidentifiedImageError)):
+            return "invalid_input"
+        return "error"
+
+    def _resume_task(self, task_id):
+        """Retry timer callback: send the task back to the first stage it still needs."""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return
+            status = task["status"]
+        if status == TaskStatus.CANCELED:
+            self._resolve_followers(task_id, None)
+            self._cleanup_task_files(task)
+            return
+        if status != TaskStatus.PENDING:
+            return
+
+        outputs = task.get("artifacts", {}).get("outputs")
+        if self._stage_done(self.stage_trackers[task_id], "process") and outputs and all(os.path.exists(p) for p in outputs):
+            # Only the upload is left; it needs neither the scheduler nor a GPU
+            try:
+                # Never block here: this runs on the one timer thread all retries share
+                self.upload_queue.put_nowait(task_id)
+                print(f"Resuming task {task_id} at upload")
+            except queue.Full:
+                self.retry_queue.schedule(task_id, 1.0)
+        else:
+            self._enqueue(task)
+
+    @staticmethod
+    def _cleanup_task_files(task):
         temp_dir = task["temp_dir"]
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        input_url = str(params["url"])
-        
-        # Determine Workflow Name
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _resolve_workflow_name(params):
+        """Workflow requested by a task, falling back on the legacy model field."""
         workflow_name = params.get("workflow")
         model_name = params.get("model")
         
@@ -245,7 +863,191 @@ class TaskManager:
                     workflow_name = "ESRGANDefeat"
             else:
                  workflow_name = "ESRGANDefeat" # Default
-                 
+        return workflow_name
+
+    @staticmethod
+    def _workflow_key(workflow_name):
+        return workflow_name[:-5] if workflow_name.endswith(".json") else workflow_name
+
+    def _input_size(self, task):
+        """Input size in bytes if it is already known locally, else None."""
+        local_input = task.get("artifacts", {}).get("input")
+        url = str(task["params"]["url"])
+        path = url[7:] if url.startswith("file://") else url
+        for candidate in (local_input, path):
+            if candidate and not candidate.startswith("http") and os.path.isfile(candidate):
+                return os.path.getsize(candidate)
+        return None
+
+    def _enqueue(self, task):
+        """Hand a pending task to the scheduler."""
+        self._schedule([task])
+
+    def _schedule(self, tasks):
+        """Hand pending tasks to the scheduler in one call."""
+        entries = [self._queue_entry(task) for task in tasks]
+        now = time.time()
+        for task_id, lane, _, _ in entries:
+            self.queued_at[task_id] = (now, lane)
+        self.scheduler.put_many(entries)
+
+    def _task_workflow(self, task):
+        return self._workflow_key(self._resolve_workflow_name(task["params"]))
+
+    def _queue_entry(self, task):
+        """
+        Scheduler entry (task_id, lane, priority, estimate) of a pending task. The lane
+        is the workflow when the scheduler config defines a lane for it, else the task type.
+        """
+        params = task["params"]
+        workflow = self._workflow_key(self._resolve_workflow_name(params))
+        task_type = getattr(params.get("type"), "value", params.get("type")) or TaskType.VIDEO.value
+        lane = workflow if workflow in self.scheduler.lane_limits else task_type
+        estimate = self.estimator.estimate(workflow, task_type, self._input_size(task))
+        return task["task_id"], lane, params.get("priority") or 0, estimate
+
+    @staticmethod
+    def _digest(*parts):
+        return hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def _source_cache_key(self, url, fingerprint):
+        """
+        Cache key from the input's identity before it is downloaded: the URL plus
+        its ETag/size/Last-Modified (or size/mtime for local files).
+        Returns None when the source offers nothing to validate against.
+        """
+        try:
+            if url.startswith("http"):
+                meta = self.downloader.probe(url)
+                if not meta["etag"] and not meta["size"]:
+                    return None
+                identity = f"{meta['etag']}|{meta['size']}|{meta['last_modified']}"
+            else:
+                path = url[7:] if url.startswith("file://") else url
+                st = os.stat(path)
+                identity = f"{st.st_size}|{st.st_mtime_ns}"
+        except Exception as e:
+            print(f"Cache probe failed for {url}: {e}")
+            return None
+        return self._digest("source", url, identity, fingerprint)
+
+    def _content_cache_key(self, local_path, fingerprint):
+        """Cache key from the downloaded input's content."""
+        h = hashlib.sha256()
+        with open(local_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return self._digest("content", h.hexdigest(), fingerprint)
+
+    def _claim_cache_key(self, task_id, key):
+        """
+        Decide how a task proceeds for a cache key:
+        "hit"      - an identical task already finished, its output was copied over
+        "attached" - an identical task is in flight, this one waits for it
+        "leader"   - this task produces the result
+        """
+        cached = self.result_cache.get(key)
+        with self.lock:
+            if cached is None:
+                # Re-check under the lock: a leader publishes before releasing its keys
+                cached = self.result_cache.get(key)
+            task = self.tasks[task_id]
+            if cached is not None:
+                task["output"] = cached["output"]
+                self.store.mark_dirty(task_id)
+            else:
+                leader = self.inflight.get(key)
+                leader_task = self.tasks.get(leader) if leader else None
+                if leader_task is None or leader == task_id or leader_task["status"] not in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+                    self.inflight[key] = task_id
+                    keys = task.setdefault("cache_keys", [])
+                    if key not in keys:
+                        keys.append(key)
+                    return "leader"
+                self.followers.setdefault(leader, []).append(task_id)
+
+        if cached is not None:
+            self._update_stage(task_id, "cache", "success", progress=100, detail=f"Reused output of task {cached['task_id']}")
+            return "hit"
+        self._update_stage(task_id, "cache", "running", progress=0, detail=f"Waiting for identical task {leader}")
+        return "attached"
+
+    def _resolve_followers(self, leader_id, output):
+        """
+        Release a finished leader's cache keys. On success the output is cached
+        and handed to every attached task; otherwise they are re-queued and one
+        of them becomes the new leader.
+        """
+        with self.lock:
+            task = self.tasks.get(leader_id)
+            keys = list(task.get("cache_keys", [])) if task else []
+        if output:
+            for key in keys:
+                self.result_cache.put(key, output, leader_id)
+
+        with self.lock:
+            for key in keys:
+                if self.inflight.get(key) == leader_id:
+                    del self.inflight[key]
+            if task:
+                task["cache_keys"] = []
+            followers = self.followers.pop(leader_id, [])
+
+        requeue = []
+        completed = []
+        for follower_id in followers:
+            with self.lock:
+                follower = self.tasks.get(follower_id)
+                if not follower or follower["status"] != TaskStatus.PROCESSING:
+                    continue
+                if output:
+                    follower["output"] = dict(output)
+                    self._set_status(follower, TaskStatus.COMPLETED)
+                    completed.append(follower_id)
+                else:
+                    self._set_status(follower, TaskStatus.PENDING)
+                    requeue.append(follower_id)
+            if output:
+                self._update_stage(follower_id, "cache", "success", progress=100, detail=f"Reused output of task {leader_id}")
+            else:
+                self._update_stage(follower_id, "cache", "pending", detail=f"Identical task {leader_id} did not finish, re-queued")
+        # A follower may itself lead another key (e.g. its source key, before it
+        # attached by content), with tasks waiting on it
+        for follower_id in completed:
+            self._resolve_followers(follower_id, output)
+        for follower_id in requeue:
+            self._enqueue(self.tasks[follower_id])
+
+    def _record_phases(self, group):
+        """Copy the sub-phase totals of finished stage spans into their tasks' stages."""
+        for root in (group.spans if group else ()):
+            task_id = root.trace.trace_id
+            tracker = self.stage_trackers.get(task_id)
+            phases = root.trace.phases(root)
+            if tracker is not None and phases and tracker.set_phases(root.name, phases):
+                self.store.mark_dirty(task_id)
+
+    def _update_stage(self, task_id, stage_name, status, duration=0.0, progress=None, detail=None):
+        # Round duration to 2 decimal places for cleaner output
+        duration = round(duration, 2)
+        # Only the task's own stage lock is taken here; the dict lookup needs no global lock
+        stage = self.stage_trackers[task_id].update(stage_name, status, duration=duration, progress=progress, detail=detail)
+        self.store.mark_dirty(task_id)
+        # Updates of a running stage replace each other in a slow subscriber's buffer;
+        # the transitions out of it are always delivered
+        self._publish_task_event(task_id, "stage", {"task_id": task_id, **stage},
+                                 key=("stage", task_id, stage_name) if status == "running" else None)
+
+    @staticmethod
+    def _stage_done(tracker, stage_name):
+        stage = tracker.get(stage_name)
+        return bool(stage) and stage["status"] == "success"
+
+    def _throttled(self, callback):
+        return ProgressThrottle(callback, min_interval=settings.progress_interval, min_delta=settings.progress_min_delta)
+
+    @staticmethod
+    def _workflow_path(workflow_name):
         workflow_path = os.path.join(os.getcwd(), "workflows", f"{workflow_name}.json")
         if not os.path.exists(workflow_path):
              # Fallback check
@@ -253,9 +1055,43 @@ class TaskManager:
                  workflow_path = os.path.join(os.getcwd(), "workflows", f"{workflow_name}")
              else:
                  raise FileNotFoundError(f"Workflow file not found: {workflow_name}")
+        return workflow_path
 
-        try:
-            # 1. Download
+    def _stage_download(self, task_id):
+        """
+        Fetch the task's input. Returns True when the task is ready for the GPU,
+        False when it was finished from the cache or attached to an identical
+        in-flight task that will complete it later.
+        """
+        task = self.tasks[task_id]
+        params = task["params"]
+        temp_dir = task["temp_dir"]
+        os.makedirs(temp_dir, exist_ok=True)
+        
+        input_url = str(params["url"])
+        workflow_path = self._workflow_path(self._resolve_workflow_name(params))
+        # Fan-out and tiling take a different processing path, so they are part of the key
+        fingerprint = self._digest(workflow_registry.get(workflow_path).fingerprint,
+                                   *(params.get(name) for name in ("fan_out", "tile", "tile_size", "tile_overlap")))
+        use_cache = settings.cache_config.get("enabled", True) and not params.get("bypass_cache")
+
+        # Artifacts of stages that already succeeded (e.g. before a restart) are reused
+        artifacts = task.setdefault("artifacts", {})
+        tracker = self.stage_trackers[task_id]
+
+        # Identical task already done or running? Decided on the source before downloading
+        if use_cache:
+            key = self._source_cache_key(input_url, fingerprint)
+            claim = self._claim_cache_key(task_id, key) if key else "leader"
+            if claim == "hit":
+                self._complete_task(task_id)
+            if claim != "leader":
+                return False
+
+        local_input = artifacts.get("input")
+        if self._stage_done(tracker, "download") and local_input and os.path.exists(local_input):
+            print(f"Reusing downloaded input {local_input} for task {task_id}")
+        else:
             start_time = time.time()
             self._update_stage(task_id, "download", "running", progress=0, detail="Starting download...")
             
@@ -280,85 +1116,300 @@ class TaskManager:
                     pct = round((current / total) * 100, 1)
                     self._update_stage(task_id, "download", "running", progress=pct, detail=f"{round(current/1024/1024, 1)}MB / {round(total/1024/1024, 1)}MB")
 
-            self._download_file(input_url, local_input, progress_callback=download_progress)
+            with tracing.span("fetch_input"):
+                self._download_file(input_url, local_input, progress_callback=self._throttled(download_progress),
+                                    cancel_event=self.cancel_events.get(task_id))
+            artifacts["input"] = local_input
+            TRANSFER_BYTES.inc("source", "in", amount=os.path.getsize(local_input))
             self._update_stage(task_id, "download", "success", duration=time.time() - start_time, progress=100, detail="Download complete")
-            
-            # 2. Process
-            start_time = time.time()
-            self._update_stage(task_id, "process", "running", progress=0, detail=f"Processing with {workflow_name}...")
-            
-            output_paths = self.comfy_pool.process_task(workflow_path, local_input, temp_dir, task_id=task_id)
-            
-            if not output_paths:
-                raise RuntimeError("Workflow produced no output files")
-            
-            local_output = output_paths[0] # Take the first output
-            local_output_filename = os.path.basename(local_output)
 
-            self._update_stage(task_id, "process", "success", duration=time.time() - start_time, progress=100, detail="Processing complete")
-            
-            # 3. Upload
-            start_time = time.time()
-            self._update_stage(task_id, "upload", "running", progress=0, detail="Starting upload...")
-            
-            oss_filename = f"outputs/{task_id}/{local_output_filename}"
-            
-            def upload_progress(consumed, total):
+        # Same check by content, for duplicates behind different URLs
+        if use_cache:
+            claim = self._claim_cache_key(task_id, self._content_cache_key(local_input, fingerprint))
+            if claim == "hit":
+                self._complete_task(task_id)
+            if claim != "leader":
+                return False
+        return True
+
+    def _stage_process(self, task_id):
+        """Run the workflow on a ComfyUI server; the server is only held for this stage."""
+        task = self.tasks[task_id]
+        workflow_name = self._resolve_workflow_name(task["params"])
+        workflow_path = self._workflow_path(workflow_name)
+        artifacts = task["artifacts"]
+        local_input = artifacts["input"]
+        tracker = self.stage_trackers[task_id]
+
+        output_paths = artifacts.get("outputs")
+        if self._stage_done(tracker, "process") and output_paths and all(os.path.exists(p) for p in output_paths):
+            print(f"Reusing processed outputs for task {task_id}")
+            return True
+
+        start_time = time.time()
+        segments = self._fanout_segments(task, local_input)
+        tiles = None if segments else self._tile_plan(task, local_input, workflow_path)
+        if segments or tiles:
+            if segments:
+                output_paths = self._process_segmented(task_id, workflow_path, local_input, segments)
+            else:
+                output_paths = self._process_tiled(task_id, workflow_path, local_input, tiles)
+            artifacts["outputs"] = output_paths
+            self.estimator.record(self._workflow_key(workflow_name), os.path.getsize(local_input), time.time() - start_time)
+            return True
+
+        self._update_stage(task_id, "process", "running", progress=0, detail=f"Processing with {workflow_name}...")
+        
+        def process_progress(current, total):
+            if total > 0:
+                pct = round((current / total) * 100, 1)
+                self._update_stage(task_id, "process", "running", progress=pct, detail=f"Executing nodes {int(current)}/{total}")
+
+        def fetch_progress(current, total):
+            size = f"{round(current/1024/1024, 1)}MB / {round(total/1024/1024, 1)}MB" if total > 0 else f"{round(current/1024/1024, 1)}MB"
+            self._update_stage(task_id, "process", "running", progress=100, detail=f"Fetching output {size}")
+
+        output_paths = self.comfy_pool.process_task(workflow_path, local_input, task["temp_dir"], task_id=task_id,
+                                                    progress_callback=self._throttled(process_progress),
+                                                    fetch_progress_callback=self._throttled(fetch_progress),
+                                                    cancel_event=self.cancel_events.get(task_id))
+        
+        if not output_paths:
+            raise RuntimeError("Workflow produced no output files")
+
+        artifacts["outputs"] = output_paths
+        self.estimator.record(self._workflow_key(workflow_name), os.path.getsize(local_input), time.time() - start_time)
+        self._update_stage(task_id, "process", "success", duration=time.time() - start_time, progress=100, detail="Processing complete")
+        return True
+
+    def _fanout_segments(self, task, local_input):
+        """
+        Number of segments to split a video task into across the pool, or None
+        to process it as a single prompt.
+        """
+        params = task["params"]
+        fanout = settings.fanout_config
+        enabled = params.get("fan_out")
+        if enabled is None:
+            enabled = fanout.get("enabled", False)
+        task_type = getattr(params.get("type"), "value", params.get("type"))
+        if not enabled or task_type != TaskType.VIDEO.value:
+            return None
+        if not self.video_splitter.available():
+            print(f"ffmpeg/ffprobe not found, processing task {task['task_id']} without fan-out")
+            return None
+
+        try:
+            probe = self.video_splitter.probe(local_input)
+        except FileNotFoundError as e:
+            print(f"ffprobe not runnable ({e}), processing task {task['task_id']} without fan-out")
+            return None
+        max_segments = fanout.get("max_segments") or self.max_workers
+        segments = min(max_segments, int(probe["duration"] // max(fanout.get("min_segment_seconds", 30), 1)))
+        if segments < 2:
+            return None
+        return {"count": segments, **probe}
+
+    def _process_segmented(self, task_id, workflow_path, local_input, segments):
+        """
+        Split a video at keyframes, run the segments through the pool in
+        parallel (each retried on its own) and join the results losslessly
+        with the original audio. Returns the output paths.
+        """
+        task = self.tasks[task_id]
+        segment_dir = os.path.join(task["temp_dir"], "segments")
+
+        start_time = time.time()
+        self._update_stage(task_id, "split", "running", progress=0, detail=f"Splitting into {segments['count']} segments...")
+        with tracing.span("split"):
+            parts = self.video_splitter.split(local_input, segment_dir, segments["count"], segments["duration"])
+        if not parts:
+            raise RuntimeError("Video split produced no segments")
+        self._update_stage(task_id, "split", "success", duration=time.time() - start_time, progress=100, detail=f"{len(parts)} segments")
+
+        segment_outputs = self._run_subtasks(task_id, workflow_path, parts, segment_dir, "segments",
+                                             retries=settings.fanout_config.get("segment_retries", 2))
+
+        start_time = time.time()
+        self._update_stage(task_id, "merge", "running", progress=0, detail="Joining segments...")
+        name = os.path.splitext(os.path.basename(local_input))[0]
+        ext = os.path.splitext(segment_outputs[0])[1]
+        output_path = os.path.join(task["temp_dir"], f"{name}_sr{ext}")
+        with tracing.span("merge"):
+            self.video_splitter.concat(segment_outputs, output_path, audio_source=local_input if segments["has_audio"] else None)
+        self._update_stage(task_id, "merge", "success", duration=time.time() - start_time, progress=100, detail="Segments joined")
+        return [output_path]
+
+    def _tile_plan(self, task, local_input, workflow_path):
+        """
+        Tile size, overlap and image size for an image task processed as tiles
+        across the pool, or None to process it as a single prompt. Per-request
+        settings override per-workflow ones, which override the defaults.
+        """
+        params = task["params"]
+        tiling = settings.tiling_config
+        workflow_conf = tiling.get("workflows", {}).get(self._workflow_key(self._resolve_workflow_name(params)), {})
+        conf = {**tiling, **workflow_conf}
+        enabled = params.get("tile")
+        if enabled is None:
+            enabled = conf.get("enabled", False)
+        task_type = getattr(params.get("type"), "value", params.get("type"))
+        if not enabled or task_type != TaskType.IMAGE.value:
+            return None
+
+        tile_size = params.get("tile_size") or conf.get("tile_size", 1024)
+        overlap = params.get("tile_overlap")
+        if overlap is None:
+            overlap = conf.get("overlap", 64)
+        with Image.open(local_input) as img:
+            size = img.size
+        if size[0] <= tile_size and size[1] <= tile_size:
+            return None
+
+        # A resolution-based upscaler targets a size for the whole image; each tile
+        # gets the share that keeps the overall scale
+        resolution = None
+        template = workflow_registry.get(workflow_path)
+        if template.resolution_node_id:
+            resolution = template.prompt[template.resolution_node_id]["inputs"]["resolution"]
+        return {"tile_size": int(tile_size), "overlap": int(overlap), "size": size, "resolution": resolution}
+
+    def _process_tiled(self, task_id, workflow_path, local_input, plan):
+        """
+        Cut an image into overlapping tiles, upscale them in parallel across the
+        pool (each retried on its own) and blend the seams. Returns the output paths.
+        """
+        task = self.tasks[task_id]
+        tile_dir = os.path.join(task["temp_dir"], "tiles")
+
+        start_time = time.time()
+        self._update_stage(task_id, "split", "running", progress=0, detail="Cutting tiles...")
+        with tracing.span("split"):
+            tiles = tiling.split_image(local_input, tile_dir, plan["tile_size"], plan["overlap"])["tiles"]
+        self._update_stage(task_id, "split", "success", duration=time.time() - start_time, progress=100, detail=f"{len(tiles)} tiles")
+
+        resolutions = None
+        if plan["resolution"]:
+            scale = plan["resolution"] / min(plan["size"])
+            resolutions = [round(min(t["box"][2] - t["box"][0], t["box"][3] - t["box"][1]) * scale) for t in tiles]
+        tile_outputs = self._run_subtasks(task_id, workflow_path, [t["path"] for t in tiles], tile_dir, "tiles",
+                                          retries=settings.tiling_config.get("tile_retries", 2), resolutions=resolutions)
+
+        start_time = time.time()
+        self._update_stage(task_id, "merge", "running", progress=0, detail="Blending tiles...")
+        name = os.path.splitext(os.path.basename(local_input))[0]
+        output_path = os.path.join(task["temp_dir"], f"{name}_sr.png")
+        with tracing.span("merge"):
+            tiling.blend_tiles(plan["size"], [t["box"] for t in tiles], tile_outputs, plan["overlap"], output_path)
+        self._update_stage(task_id, "merge", "success", duration=time.time() - start_time, progress=100, detail="Tiles blended")
+        return [output_path]
+
+    def _run_subtasks(self, task_id, workflow_path, inputs, work_dir, label, retries=2, resolutions=None):
+        """
+        Run parts of a task (video segments, image tiles) through the pool in
+        parallel, retrying each part on its own. Progress is aggregated into the
+        task's process stage. Returns the first output of each part, in order.
+        """
+        task = self.tasks[task_id]
+        start_time = time.time()
+        self._update_stage(task_id, "process", "running", progress=0, detail=f"Processing {len(inputs)} {label}...")
+        # Outputs of finished parts, by index, so a retried task only redoes the rest
+        done = task["artifacts"].setdefault("subtask_outputs", {})
+        fractions = [0.0] * len(inputs)
+
+        def process_progress(current, total):
+            finished = sum(1 for f in fractions if f >= 1.0)
+            pct = round(current / total * 100, 1)
+            self._update_stage(task_id, "process", "running", progress=pct, detail=f"{label.capitalize()} {finished}/{total} done")
+        report = self._throttled(process_progress)
+
+        def run_part(index, part_path):
+            key = str(index)
+            if done.get(key) and os.path.exists(done[key]):
+                fractions[index] = 1.0
+                report(sum(fractions), len(inputs))
+                return done[key]
+
+            def part_progress(current, total):
                 if total > 0:
-                    pct = round((consumed / total) * 100, 1)
-                    self._update_stage(task_id, "upload", "running", progress=pct, detail=f"{round(consumed/1024/1024, 1)}MB / {round(total/1024/1024, 1)}MB")
+                    fractions[index] = min(current / total, 0.99)
+                    report(sum(fractions), len(inputs))
 
-            success = self.oss_handler.upload_file(local_output, oss_filename, progress_callback=upload_progress)
-            if not success:
-                raise RuntimeError("Failed to upload to OSS")
-                
-            # Construct OSS URL
-            bucket_name = self.oss_handler.config['bucket_name']
-            endpoint = self.oss_handler.config['endpoint']
-            if not endpoint.startswith("http"):
-                endpoint = "https://" + endpoint
-            ep_host = endpoint.split("://")[-1]
-            output_url = f"https://{bucket_name}.{ep_host}/{oss_filename}"
-            
-            file_size = os.path.getsize(local_output) / (1024 * 1024) # MB
-            
-            with self.lock:
-                self.tasks[task_id]["output"] = {
-                    "url": output_url,
-                    "size_mb": round(file_size, 2)
-                }
-            
-            self._update_stage(task_id, "upload", "success", duration=time.time() - start_time, progress=100, detail="Upload complete")
+            for attempt in range(retries + 1):
+                try:
+                    with tracing.span(label[:-1], index=index, attempt=attempt + 1):
+                        outputs = self.comfy_pool.process_task(workflow_path, part_path, os.path.join(work_dir, f"out_{index:03d}"),
+                                                               task_id=f"{task_id}_{label[0]}{index:03d}", progress_callback=part_progress,
+                                                               resolution=resolutions[index] if resolutions else None,
+                                                               cancel_event=self.cancel_events.get(task_id))
+                    if not outputs:
+                        raise RuntimeError(f"Part {index} produced no output files")
+                    fractions[index] = 1.0
+                    report(sum(fractions), len(inputs))
+                    with self.lock:
+                        done[key] = outputs[0]
+                    self.store.mark_dirty(task_id)
+                    return outputs[0]
+                except Exception as e:
+                    if attempt >= retries or not self._is_retryable(e):
+                        raise
+                    fractions[index] = 0.0
+                    print(f"Part {index} ({label}) of task {task_id} failed ({e}), retrying ({attempt + 1}/{retries})...")
 
-        finally:
-            # Cleanup
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+        # No more threads than pool slots: further parts would only wait in _acquire
+        with ThreadPoolExecutor(max_workers=max(1, min(len(inputs), self.max_workers)),
+                                thread_name_prefix=f"{label}-{task_id[:8]}") as pool:
+            # Parts run under this stage's span, in the executor's threads
+            futures = [pool.submit(tracing.bind(run_part), i, path) for i, path in enumerate(inputs)]
+            outputs = [f.result() for f in futures]
+        self._update_stage(task_id, "process", "success", duration=time.time() - start_time, progress=100, detail=f"{len(inputs)} {label} processed")
+        return outputs
 
+    def _stage_upload(self, task_id):
+        """Upload the task's output to OSS and record its URL."""
+        local_output = self.tasks[task_id]["artifacts"]["outputs"][0] # Take the first output
+        local_output_filename = os.path.basename(local_output)
+        
+        start_time = time.time()
+        self._update_stage(task_id, "upload", "running", progress=0, detail="Starting upload...")
+        
+        oss_filename = f"outputs/{task_id}/{local_output_filename}"
+        
+        def upload_progress(consumed, total):
+            if total > 0:
+                pct = round((consumed / total) * 100, 1)
+                self._update_stage(task_id, "upload", "running", progress=pct, detail=f"{round(consumed/1024/1024, 1)}MB / {round(total/1024/1024, 1)}MB")
 
-    def _download_file(self, url, local_path, progress_callback=None):
-        if url.startswith("http"):
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        with tracing.span("oss_upload", bytes=os.path.getsize(local_output)):
+            success = self.oss_handler.upload_file(local_output, oss_filename, progress_callback=self._throttled(upload_progress),
+                                                   cancel_event=self.cancel_events.get(task_id))
+        if not success:
+            raise RuntimeError("Failed to upload to OSS")
+            
+        # Construct OSS URL
+        bucket_name = self.oss_handler.config['bucket_name']
+        endpoint = self.oss_handler.config['endpoint']
+        if not endpoint.startswith("http"):
+            endpoint = "https://" + endpoint
+        ep_host = endpoint.split("://")[-1]
+        output_url = f"https://{bucket_name}.{ep_host}/{oss_filename}"
+        
+        TRANSFER_BYTES.inc("oss", "out", amount=os.path.getsize(local_output))
+        file_size = os.path.getsize(local_output) / (1024 * 1024) # MB
+        
+        with self.lock:
+            self.tasks[task_id]["output"] = {
+                "url": output_url,
+                "size_mb": round(file_size, 2)
             }
-            with requests.get(url, stream=True, headers=headers) as r:
-                r.raise_for_status()
-                total_length = r.headers.get('content-length')
-                
-                with open(local_path, 'wb') as f:
-                    if total_length is None: # no content length header
-                        f.write(r.content)
-                        if progress_callback:
-                            progress_callback(1, 1) # Just say done
-                    else:
-                        dl = 0
-                        total_length = int(total_length)
-                        for chunk in r.iter_content(chunk_size=8192):
-                            dl += len(chunk)
-                            f.write(chunk)
-                            if progress_callback:
-                                progress_callback(dl, total_length)
-                                
+        self.store.mark_dirty(task_id)
+        
+        self._update_stage(task_id, "upload", "success", duration=time.time() - start_time, progress=100, detail="Upload complete")
+        return True
+
+    def _download_file(self, url, local_path, progress_callback=None, cancel_event=None):
+        if url.startswith("http"):
+            self.downloader.download(url, local_path, progress_callback=progress_callback, cancel_event=cancel_event)
         elif url.startswith("file://"):
             src_path = url[7:]
             if os.path.exists(src_path):
@@ -383,6 +1434,6 @@ class TaskManager:
                     size = os.path.getsize(url)
                     progress_callback(size, size)
             else:
-                raise ValueError(f"Unsupported URL scheme or file not found: {url}")
+                raise InvalidTaskError(f"Unsupported URL scheme or file not found: {url}")
 
 task_manager = TaskManager()
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional
+
+class TaskStore:
+    """
+    Persistence interface for task records.
+
+    TaskManager only marks tasks dirty or deleted; the store decides when to
+    write. Dirty tasks are read back through the snapshot callable given to
+    start(), so only the latest state of a task is written, however many
+    updates it received in between.
+    """
+    def load(self) -> List[Dict]:
+        """Return all persisted task records."""
+        return []
+
+    def start(self, snapshot: Callable[[str], Optional[Dict]]):
+        pass
+
+    def mark_dirty(self, task_id: str):
+        pass
+
+    def mark_deleted(self, task_id: str):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class MemoryTaskStore(TaskStore):
+    """No persistence: tasks live only in TaskManager's memory."""
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite (WAL mode) task store.
+    Writes are batched on a background thread every flush_interval seconds,
+    one transaction per batch.
+    """
+    def __init__(self, path: str = "tasks.db", flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " created_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)")
+        self.conn.commit()
+
+        self.lock = threading.Lock()        # guards dirty/deleted
+        self.write_lock = threading.Lock()  # serializes use of the connection
+        self.dirty = set()
+        self.deleted = set()
+        self.snapshot: Optional[Callable[[str], Optional[Dict]]] = None
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def load(self) -> List[Dict]:
+        with self.write_lock:
+            rows = self.conn.execute("SELECT data FROM tasks ORDER BY created_at").fetchall()
+        tasks = []
+        for (data,) in rows:
+            try:
+                tasks.append(json.loads(data))
+            except ValueError as e:
+                print(f"[TaskStore] Skipping unreadable task record: {e}")
+        return tasks
+
+    def start(self, snapshot: Callable[[str], Optional[Dict]]):
+        self.snapshot = snapshot
+        self.thread = threading.Thread(target=self._writer_loop, name="task-store-writer", daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self, task_id: str):
+        with self.lock:
+            self.dirty.add(task_id)
+
+    def mark_deleted(self, task_id: str):
+        with self.lock:
+            self.dirty.discard(task_id)
+            self.deleted.add(task_id)
+
+    def _writer_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[TaskStore] Flush failed: {e}")
+
+    def flush(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            deleted, self.deleted = self.deleted, set()
+        if not dirty and not deleted:
+            return
+
+        try:
+            rows = []
+            removed = set(deleted)
+            for task_id in dirty:
+                data = self.snapshot(task_id) if self.snapshot else None
+                if data is None:
+                    removed.add(task_id)
+                    continue
+                rows.append((
+                    task_id, getattr(data["status"], "value", data["status"]),
+                    data["created_at"], data["updated_at"], json.dumps(data, default=str)
+                ))
+
+            with self.write_lock:
+                with self.conn:
+                    if rows:
+                        self.conn.executemany(
+                            "INSERT OR REPLACE INTO tasks (task_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                            rows
+                        )
+                    if removed:
+                        self.conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(t,) for t in removed])
+        except Exception:
+            # Nothing was committed; keep the writes for the next flush, unless
+            # a task was marked since (deleted again, or dirty again)
+            with self.lock:
+                self.deleted |= deleted - self.dirty
+                self.dirty |= dirty - self.deleted
+            raise
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.flush()
+        with self.write_lock:
+            self.conn.close()
+
+def create_task_store(config: Dict) -> TaskStore:
+    backend = config.get("backend", "sqlite")
+    if backend == "memory":
+        return MemoryTaskStore()
+    if backend == "sqlite":
+        return SQLiteTaskStore(
+            path=config.get("path", "tasks.db"),
+            flush_interval=config.get("flush_interval_ms", 500) / 1000.0
+        )
+    raise ValueError(f"Unknown task store backend: {backend}")
@@ -1,3 +1,6 @@
 from .oss import OSSHandler
+from .downloader import RangedDownloader
 from .comfy_pool import ComfyAPIPool
-from .comfy_utils import NGSRWorkflow, WorkflowConverter
+from .comfy_utils import NGSRWorkflow, WorkflowConverter, workflow_registry
+from .video_split import VideoSplitter
+from .errors import TaskCanceledError, InvalidTaskError
@@ -1,38 +1,331 @@
 import os
-import queue
 import time
 import threading
-from typing import List, Tuple, Dict, Optional
-from .comfy_utils import run_workflow_task
+import requests
+import websocket
+from typing import Callable, List, Tuple, Dict, Optional
+from .comfy_utils import run_workflow_task, run_workflow_batch, AllSet, ComfyUIClient, PromptTimeoutError
+from .errors import TaskCanceledError
+from .metrics import Counter, GaugeFunc, Histogram, TRANSFER_BYTES
+from . import tracing
+
+# Errors that say something about the server rather than the task
+SERVER_ERRORS = (requests.ConnectionError, requests.Timeout, websocket.WebSocketException, ConnectionError, TimeoutError)
+
+PROMPTS = Counter("tmlsr_comfyui_prompts_total", "Prompts run per server, by outcome (success, error, canceled).",
+                  ("server", "outcome"))
+PROMPT_SECONDS = Histogram("tmlsr_comfyui_prompt_seconds", "Time a prompt held a server slot, upload to fetched outputs.",
+                           ("server",))
+SLOT_WAIT_SECONDS = Histogram("tmlsr_comfyui_slot_wait_seconds", "Time spent waiting for a free server slot.",
+                              ("workflow",))
 
 class ComfyAPIPool:
-    def __init__(self, servers: List[str]):
+    def __init__(self, servers: List[str], health_config: Optional[Dict] = None, affinity_config: Optional[Dict] = None,
+                 inflight_per_server: int = 1, execution_timeout: float = 300, queue_timeout: float = 3600):
         """
         Initialize the API pool with a list of server addresses.
-        Each server is added to a thread-safe queue for load balancing.
+        Servers are handed out by load (ComfyUI queue depth, free VRAM) among
+        those that pass health checks; failing servers are ejected by a
+        circuit breaker and re-admitted with exponential backoff.
+        Servers that last ran the same workflow (models still loaded) are
+        preferred, and workflows can be pinned to groups of servers.
+        Each server takes up to inflight_per_server prompts at once, so the next
+        prompt's upload and queueing overlap the current execution in ComfyUI's queue.
+        A prompt may execute for execution_timeout seconds and wait in the
+        server's queue for queue_timeout seconds before it is stopped.
         """
+        health_config = health_config or {}
+        affinity_config = affinity_config or {}
+        self.probe_interval = health_config.get("probe_interval", 5)
+        self.probe_timeout = health_config.get("probe_timeout", 5)
+        self.failure_threshold = health_config.get("failure_threshold", 3)
+        self.backoff_base = health_config.get("backoff_base", 10)
+        self.backoff_max = health_config.get("backoff_max", 300)
+
+        # A task waits at most max_wait seconds for a server that has its workflow
+        # loaded, and never for one while a server idle for idle_seconds could switch
+        self.affinity_max_wait = affinity_config.get("max_wait", 30)
+        self.affinity_idle_seconds = affinity_config.get("idle_seconds", 60)
+        # Each such wait parks a worker next to a free slot, so at most max_waiters
+        # tasks wait at once (the task manager runs that many spare GPU workers)
+        self.affinity_max_waiters = max(0, int(affinity_config.get("max_waiters", len(servers))))
+        self.affinity_waiters = 0
+        # workflow -> servers it may run on
+        groups = affinity_config.get("server_groups", {})
+        self.workflow_servers: Dict[str, List[str]] = {
+            os.path.splitext(workflow)[0]: groups.get(group, [])
+            for workflow, group in affinity_config.get("workflow_groups", {}).items()
+        }
+
         self.servers = servers
-        self.server_queue = queue.Queue()
-        for server in servers:
-            self.server_queue.put(server)
+        self.inflight_per_server = max(1, int(inflight_per_server))
+        self.cond = threading.Condition()
+        self.lock = self.cond
         
-        # Monitor server status
+        # Monitor server status. Each server has `slots` prompts it may hold at once;
+        # "tasks" lists the ones in use, task_id is the oldest of them
         self.server_status: Dict[str, Dict] = {
-            s: {"status": "idle", "task_id": None, "last_active": None} 
+            s: {"status": "idle", "task_id": None, "tasks": [], "slots": self.inflight_per_server,
+                "in_use": 0, "last_active": None, "workflow": None}
+            for s in servers
+        }
+        # Circuit breaker and load figures per server.
+        # state: "healthy", "open" (ejected until open_until) or "half_open" (one trial task allowed)
+        self.health: Dict[str, Dict] = {
+            s: {
+                "state": "healthy", "failures": 0, "open_until": 0.0, "backoff": self.backoff_base,
+                "queue_remaining": 0, "vram_free": None, "vram_total": None,
+                "latency_ms": None, "last_probe": None, "last_error": None
+            }
             for s in servers
         }
-        self.lock = threading.Lock()
+
+        # Busy time per server (at least one slot in use), kept under self.lock
+        self.busy_seconds: Dict[str, float] = {s: 0.0 for s in servers}
+        self.busy_since: Dict[str, Optional[float]] = {s: None for s in servers}
+        self._register_metrics()
+
+        # One long-lived client (keep-alive HTTP session + WebSocket) per server
+        self.clients: Dict[str, ComfyUIClient] = {
+            s: ComfyUIClient(s, execution_timeout=execution_timeout, queue_timeout=queue_timeout) for s in servers
+        }
+        threading.Thread(target=self._warm_up, daemon=True).start()
+        threading.Thread(target=self._probe_loop, name="comfy-health", daemon=True).start()
+
+    def _warm_up(self):
+        """Start each server's event listener so the first tasks don't pay for the connection."""
+        for client in self.clients.values():
+            client.listener.start()
+
+    def _register_metrics(self):
+        def busy():
+            now = time.time()
+            with self.lock:
+                return {(s,): total + (now - self.busy_since[s] if self.busy_since[s] else 0.0)
+                        for s, total in self.busy_seconds.items()}
+
+        def per_server(field):
+            def read():
+                with self.lock:
+                    return {(s,): info[field] for s, info in self.server_status.items()}
+            return read
+
+        def up():
+            with self.lock:
+                return {(s,): 1 if health["state"] == "healthy" else 0 for s, health in self.health.items()}
+
+        GaugeFunc("tmlsr_comfyui_busy_seconds_total", "Time each server had at least one prompt in flight; "
+                  "its rate is the server's utilization.", ("server",), busy, kind="counter")
+        GaugeFunc("tmlsr_comfyui_slots", "Prompt slots per server.", ("server",), per_server("slots"))
+        GaugeFunc("tmlsr_comfyui_slots_in_use", "Prompt slots in use per server.", ("server",), per_server("in_use"))
+        GaugeFunc("tmlsr_comfyui_up", "1 if the server passes health checks, 0 while ejected or on trial.", ("server",), up)
+
+    def close(self):
+        for client in self.clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
 
     def get_status(self) -> List[Dict]:
-        """Return the current status of all servers."""
+        """Return the current status and health of all servers."""
         with self.lock:
             # Create a list of status objects
             return [
-                {"address": addr, **info}
+                {"address": addr, **info, "tasks": list(info["tasks"]), "health": dict(self.health[addr])}
                 for addr, info in self.server_status.items()
             ]
 
-    def process_task(self, workflow_path: str, input_path: str, output_dir: str, task_id: Optional[str] = None) -> List[str]:
+    # Health checks
+
+    def _probe_loop(self):
+        while True:
+            for server in self.servers:
+                self._probe(server)
+            time.sleep(self.probe_interval)
+
+    def _probe(self, server: str):
+        with self.lock:
+            health = self.health[server]
+            if health["state"] == "open" and time.time() < health["open_until"]:
+                return
+        client = self.clients[server]
+        start = time.time()
+        try:
+            stats = client.get_system_stats(timeout=self.probe_timeout)
+            queue_info = client.get_queue(timeout=self.probe_timeout)
+        except Exception as e:
+            self._record_failure(server, f"probe: {e}")
+            return
+
+        devices = stats.get("devices") or []
+        with self.lock:
+            health["latency_ms"] = round((time.time() - start) * 1000, 1)
+            health["last_probe"] = time.time()
+            health["queue_remaining"] = len(queue_info.get("queue_running", [])) + len(queue_info.get("queue_pending", []))
+            if devices:
+                health["vram_free"] = sum(d.get("vram_free", 0) for d in devices)
+                health["vram_total"] = sum(d.get("vram_total", 0) for d in devices)
+            if health["state"] == "open":
+                # Back off done and the server answers: let one task try it
+                health["state"] = "half_open"
+                print(f"[Pool] Server {server} answers again, admitting a trial task")
+            elif health["state"] == "half_open" and self.server_status[server]["in_use"] == 0:
+                # No trial task came along since the last probe; two good probes in a row will do
+                health["state"] = "healthy"
+                health["failures"] = 0
+                health["backoff"] = self.backoff_base
+                health["last_error"] = None
+                print(f"[Pool] Server {server} re-admitted after a successful probe")
+            elif health["state"] == "healthy":
+                health["failures"] = 0
+            self.cond.notify_all()
+
+    def _record_failure(self, server: str, error: str):
+        with self.lock:
+            health = self.health[server]
+            health["failures"] += 1
+            health["last_error"] = error
+            if health["state"] == "half_open" or (health["state"] == "healthy" and health["failures"] >= self.failure_threshold):
+                if health["state"] == "half_open":
+                    health["backoff"] = min(health["backoff"] * 2, self.backoff_max)
+                health["state"] = "open"
+                health["open_until"] = time.time() + health["backoff"]
+                print(f"[Pool] Ejecting server {server} for {health['backoff']}s: {error}")
+            elif health["state"] == "open":
+                health["backoff"] = min(health["backoff"] * 2, self.backoff_max)
+                health["open_until"] = time.time() + health["backoff"]
+
+    def _record_success(self, server: str):
+        with self.lock:
+            health = self.health[server]
+            if health["state"] != "healthy":
+                print(f"[Pool] Server {server} re-admitted")
+            health["state"] = "healthy"
+            health["failures"] = 0
+            health["backoff"] = self.backoff_base
+            health["last_error"] = None
+
+    # Selection
+
+    def _load_key(self, server: str) -> Tuple:
+        health = self.health[server]
+        # Fewest of our prompts on it, fewest prompts queued on the server, then most free VRAM
+        return (self.server_status[server]["in_use"], health["queue_remaining"], -(health["vram_free"] or 0))
+
+    def _available(self, server: str, workflow: Optional[str] = None) -> bool:
+        info = self.server_status[server]
+        state = self.health[server]["state"]
+        if state == "half_open":
+            # A recovering server gets a single trial prompt
+            return info["in_use"] == 0
+        if state != "healthy" or info["in_use"] >= info["slots"]:
+            return False
+        # Stacking a different workflow behind a running one would swap models mid-queue
+        return info["in_use"] == 0 or workflow is None or info["workflow"] == workflow
+
+    def _allowed_servers(self, workflow: Optional[str]) -> List[str]:
+        pinned = self.workflow_servers.get(workflow) if workflow else None
+        return [s for s in self.servers if s in pinned] if pinned else self.servers
+
+    def _pick(self, workflow: Optional[str], waited: float, may_wait: bool = True) -> Optional[str]:
+        """
+        Choose a server for a workflow, or None to keep waiting.
+        Order: idle servers with the workflow loaded, idle servers with nothing
+        loaded, free slots behind a running prompt of the same workflow, then
+        servers that would have to switch models. Switching is only
+        done when no busy server has the workflow loaded, the task has waited
+        affinity_max_wait, the server has been idle for affinity_idle_seconds,
+        or the task may not wait (may_wait is False).
+        """
+        allowed = self._allowed_servers(workflow)
+        candidates = [s for s in allowed if self._available(s, workflow)]
+        if not candidates:
+            return None
+        if workflow is None:
+            return min(candidates, key=self._load_key)
+
+        warm = [s for s in candidates if self.server_status[s]["workflow"] == workflow]
+        if warm and min(self.server_status[s]["in_use"] for s in warm) == 0:
+            return min(warm, key=self._load_key)
+        blank = [s for s in candidates if self.server_status[s]["workflow"] is None]
+        if blank:
+            return min(blank, key=self._load_key)
+        if warm:
+            # Queue behind a running prompt of the same workflow
+            return min(warm, key=self._load_key)
+
+        warm_busy = any(
+            self.server_status[s]["workflow"] == workflow and self.health[s]["state"] != "open"
+            for s in allowed
+        )
+        if not warm_busy or waited >= self.affinity_max_wait or not may_wait:
+            return min(candidates, key=self._load_key)
+        now = time.time()
+        cold = [s for s in candidates if now - (self.server_status[s]["last_active"] or 0) >= self.affinity_idle_seconds]
+        if cold:
+            return min(cold, key=self._load_key)
+        return None
+
+    def _acquire(self, task_id: Optional[str], workflow: Optional[str] = None, cancel_event=None) -> str:
+        """
+        Block until a suitable healthy server is free and claim it. Raises
+        TaskCanceledError, within a second, once cancel_event is set.
+        """
+        wait_start = time.time()
+        parked = False # counted in affinity_waiters: passing up a free slot for a warm server
+        with self.cond:
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise TaskCanceledError(f"Task {task_id} canceled while waiting for a server")
+                    may_wait = parked or self.affinity_waiters < self.affinity_max_waiters
+                    server = self._pick(workflow, time.time() - wait_start, may_wait)
+                    if server is not None:
+                        info = self.server_status[server]
+                        if workflow and info["workflow"] not in (None, workflow):
+                            print(f"[Pool] Switching server {server} from {info['workflow']} to {workflow}")
+                        info["tasks"].append(task_id)
+                        info["in_use"] += 1
+                        if info["in_use"] == 1:
+                            self.busy_since[server] = time.time()
+                        SLOT_WAIT_SECONDS.observe(time.time() - wait_start, workflow or "")
+                        info["status"] = "busy"
+                        info["task_id"] = info["tasks"][0]
+                        info["last_active"] = time.time()
+                        info["workflow"] = workflow or info["workflow"]
+                        # Assume our prompt adds to its queue until the next probe says otherwise
+                        self.health[server]["queue_remaining"] += 1
+                        return server
+                    free = any(self._available(s, workflow) for s in self._allowed_servers(workflow))
+                    if free != parked:
+                        self.affinity_waiters += 1 if free else -1
+                        parked = free
+                    # Wake up periodically: waiting time and idle time change the answer
+                    self.cond.wait(timeout=1.0)
+            finally:
+                if parked:
+                    self.affinity_waiters -= 1
+
+    def _release(self, server: str, task_id: Optional[str] = None):
+        with self.cond:
+            info = self.server_status[server]
+            if task_id in info["tasks"]:
+                info["tasks"].remove(task_id)
+            info["in_use"] = max(info["in_use"] - 1, 0)
+            if info["in_use"] == 0 and self.busy_since[server] is not None:
+                self.busy_seconds[server] += time.time() - self.busy_since[server]
+                self.busy_since[server] = None
+            info["status"] = "busy" if info["in_use"] else "idle"
+            info["task_id"] = info["tasks"][0] if info["tasks"] else None
+            info["last_active"] = time.time()
+            health = self.health[server]
+            health["queue_remaining"] = max(health["queue_remaining"] - 1, 0)
+            self.cond.notify_all()
+
+    def process_task(self, workflow_path: str, input_path: str, output_dir: str, task_id: Optional[str] = None,
+                     progress_callback: Optional[Callable] = None, fetch_progress_callback: Optional[Callable] = None,
+                     resolution: Optional[int] = None, cancel_event: Optional[threading.Event] = None) -> List[str]:
         """
         Process a single task using an available server from the pool.
         
@@ -41,40 +334,101 @@ class ComfyAPIPool:
             input_path (str): Path to the input file (image/video).
             output_dir (str): Directory to save outputs.
             task_id (str, optional): Task ID for monitoring purposes.
+            progress_callback (callable, optional): Called with (current, total) executed nodes.
+            fetch_progress_callback (callable, optional): Called with (current, total) bytes of output fetched.
+            resolution (int, optional): Target resolution for resolution-based upscalers (e.g. per image tile).
+            cancel_event (threading.Event, optional): When set, the prompt is stopped on the server
+                and the slot released right away (TaskCanceledError is raised).
             
         Returns:
             List[str]: List of output file paths.
         """
-        # 1. Acquire a server (blocks until one is available)
-        server = self.server_queue.get()
+        # 1. Acquire a slot on a server (blocks until a healthy one is available), keeping workflows on warm servers
+        workflow = os.path.splitext(os.path.basename(workflow_path))[0]
+        with tracing.span("pool.slot_wait", workflow=workflow) as sp:
+            server = self._acquire(task_id, workflow, cancel_event)
+            sp.set(server=server)
         print(f"[Pool] Assigned task {task_id or 'unknown'} ({os.path.basename(input_path)}) to server {server}")
-        
-        # Update status to busy
-        with self.lock:
-            self.server_status[server] = {
-                "status": "busy",
-                "task_id": task_id,
-                "last_active": time.time()
-            }
+        start_time = time.time()
+        outcome = "error"
 
         try:
             # 2. Execute the workflow using the utility function
-            # run_workflow_task handles connection, upload, execution, and download
-            return run_workflow_task(server, workflow_path, input_path, output_dir)
+            # run_workflow_task handles upload, execution, and download over the server's persistent client.
+            # Prompts sharing a server must not overwrite each other's input, so the upload name is per task
+            upload_name = f"{task_id}_{os.path.basename(input_path)}" if task_id else None
+            with tracing.span("comfyui.prompt", server=server, workflow=workflow):
+                outputs = run_workflow_task(server, workflow_path, input_path, output_dir, client=self.clients[server],
+                                            progress_callback=progress_callback, fetch_progress_callback=fetch_progress_callback,
+                                            upload_name=upload_name, resolution=resolution, cancel_event=cancel_event)
+            self._record_success(server)
+            outcome = "success"
+            self._record_transfer([input_path], outputs)
+            return outputs
             
         except Exception as e:
             print(f"[Pool] Error processing task on {server}: {e}")
+            if isinstance(e, TaskCanceledError):
+                outcome = "canceled"
+            if self._is_server_error(e):
+                self._record_failure(server, str(e))
             raise e
             
         finally:
-            # Update status to idle
-            with self.lock:
-                self.server_status[server] = {
-                    "status": "idle",
-                    "task_id": None,
-                    "last_active": time.time()
-                }
-
-            # 3. Release the server back to the pool
-            self.server_queue.put(server)
-            # print(f"[Pool] Server {server} released.")
+            # 3. Release the slot back to the pool
+            self._release(server, task_id)
+            PROMPTS.inc(server, outcome)
+            PROMPT_SECONDS.observe(time.time() - start_time, server)
+
+    def process_batch(self, workflow_path: str, input_paths: List[str], output_dirs: List[str], task_ids: List[str],
+                      progress_callback: Optional[Callable] = None,
+                      cancel_events: Optional[List[threading.Event]] = None) -> List[List[str]]:
+        """
+        Process several small images as one prompt on a single server slot,
+        saving the fixed per-prompt overhead. Returns the output paths of each input.
+        cancel_events (one per input): the prompt is stopped and the slot released
+        once all are set (TaskCanceledError); canceled inputs get no outputs.
+        """
+        workflow = os.path.splitext(os.path.basename(workflow_path))[0]
+        with tracing.span("pool.slot_wait", workflow=workflow) as sp:
+            server = self._acquire(task_ids[0], workflow, AllSet(cancel_events) if cancel_events else None)
+            sp.set(server=server)
+        print(f"[Pool] Assigned batch of {len(task_ids)} tasks ({task_ids[0]}, ...) to server {server}")
+        start_time = time.time()
+        outcome = "error"
+
+        try:
+            upload_names = [f"{task_id}_{os.path.basename(path)}" for task_id, path in zip(task_ids, input_paths)]
+            with tracing.span("comfyui.prompt", server=server, workflow=workflow, batch=len(task_ids)):
+                outputs = run_workflow_batch(workflow_path, input_paths, output_dirs, self.clients[server],
+                                             progress_callback=progress_callback, upload_names=upload_names,
+                                             cancel_events=cancel_events)
+            self._record_success(server)
+            outcome = "success"
+            self._record_transfer(input_paths, [path for paths in outputs for path in paths])
+            return outputs
+
+        except Exception as e:
+            print(f"[Pool] Error processing batch on {server}: {e}")
+            if isinstance(e, TaskCanceledError):
+                outcome = "canceled"
+            if self._is_server_error(e):
+                self._record_failure(server, str(e))
+            raise e
+
+        finally:
+            self._release(server, task_ids[0])
+            PROMPTS.inc(server, outcome)
+            PROMPT_SECONDS.observe(time.time() - start_time, server)
+
+    @staticmethod
+    def _record_transfer(inputs: List[str], outputs: List[str]):
+        TRANSFER_BYTES.inc("comfyui", "out", amount=sum(os.path.getsize(p) for p in inputs if os.path.exists(p)))
+        TRANSFER_BYTES.inc("comfyui", "in", amount=sum(os.path.getsize(p) for p in outputs if os.path.exists(p)))
+
+    @staticmethod
+    def _is_server_error(e: Exception) -> bool:
+        if isinstance(e, PromptTimeoutError):
+            # A slow prompt (or a long queue ahead of it) is not a broken server
+            return False
+        return isinstance(e, SERVER_ERRORS) or (isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code >= 500)
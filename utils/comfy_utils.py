@@ -1,17 +1,228 @@
 import websocket
 import uuid
 import json
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import time
-from typing import Dict, List, Union, Any, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Union, Any, Optional
+from .errors import InvalidTaskError, TaskCanceledError
+from . import tracing
+
+class ComfyExecutionError(RuntimeError):
+    """Raised when ComfyUI reports execution_error/execution_interrupted for a prompt."""
+    def __init__(self, prompt_id: str, data: Dict):
+        self.prompt_id = prompt_id
+        self.data = data
+        node = data.get("node_type") or data.get("node_id") or "unknown node"
+        message = data.get("exception_message") or "execution interrupted"
+        super().__init__(f"ComfyUI execution failed at {node}: {message}")
+
+class PromptTimeoutError(TimeoutError):
+    """A prompt took too long to start or to execute; it has been removed from the server."""
+
+class PromptWatch:
+    """
+    A prompt being waited on through ComfyEventListener.
+    The future resolves to None on success or raises ComfyExecutionError.
+    """
+    def __init__(self, prompt_id: str, total_nodes: int = 0, progress_callback: Optional[Callable] = None):
+        self.prompt_id = prompt_id
+        self.total_nodes = total_nodes
+        self.progress_callback = progress_callback
+        self.future: Future = Future()
+        self.done_nodes = set()
+        self.current_node: Optional[str] = None
+        self.started_at: Optional[float] = None # when ComfyUI took the prompt off its queue
+
+    def report_progress(self, node_fraction: float = 0.0):
+        if not self.progress_callback or self.total_nodes <= 0:
+            return
+        current = min(len(self.done_nodes) + node_fraction, self.total_nodes)
+        try:
+            self.progress_callback(current, self.total_nodes)
+        except Exception as e:
+            print(f"[ComfyUI] Progress callback error for {self.prompt_id}: {e}")
+
+class ComfyEventListener:
+    """
+    Single reader of a client's WebSocket.
+    Every event is routed to the PromptWatch registered for its prompt_id, so
+    any number of prompts can be in flight on one socket and one thread.
+    """
+    # Outcomes of prompts that finished before anyone started watching them
+    RECENT_LIMIT = 256
+
+    def __init__(self, client: "ComfyUIClient"):
+        self.client = client
+        self.watches: Dict[str, PromptWatch] = {}
+        self.recent: "OrderedDict[str, Optional[ComfyExecutionError]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name=f"comfy-events-{self.client.server_address}", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def watch(self, prompt_id: str, total_nodes: int = 0, progress_callback: Optional[Callable] = None) -> PromptWatch:
+        watch = PromptWatch(prompt_id, total_nodes, progress_callback)
+        with self.lock:
+            if prompt_id in self.recent:
+                error = self.recent.pop(prompt_id)
+                if error:
+                    watch.future.set_exception(error)
+                else:
+                    watch.future.set_result(None)
+                return watch
+            self.watches[prompt_id] = watch
+        return watch
+
+    def unwatch(self, prompt_id: str):
+        with self.lock:
+            self.watches.pop(prompt_id, None)
+
+    def _finish(self, prompt_id: str, error: Optional[ComfyExecutionError] = None):
+        with self.lock:
+            watch = self.watches.pop(prompt_id, None)
+            if watch is None:
+                self.recent[prompt_id] = error
+                while len(self.recent) > self.RECENT_LIMIT:
+                    self.recent.popitem(last=False)
+                return
+        if watch.future.done():
+            return
+        if error:
+            watch.future.set_exception(error)
+        else:
+            watch.future.set_result(None)
+
+    def _run(self):
+        backoff = 1.0
+        reconnect = False
+        while self.running:
+            try:
+                if reconnect:
+                    self.client.connect()
+                else:
+                    self.client.ensure_connected()
+                self._reconcile()
+                backoff = 1.0
+                self._read_loop()
+            except Exception as e:
+                if not self.running:
+                    break
+                reconnect = True
+                print(f"[ComfyUI] Event listener for {self.client.server_address} lost connection ({e}), retrying in {backoff:.0f}s...")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _read_loop(self):
+        ws = self.client.ws
+        ws.settimeout(5)
+        while self.running:
+            try:
+                out = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            if not isinstance(out, str):
+                # Binary frames are previews, not needed here
+                continue
+            try:
+                message = json.loads(out)
+            except ValueError:
+                continue
+            self._dispatch(message)
+
+    def _reconcile(self):
+        """Events sent while disconnected are lost; ask history about prompts still pending."""
+        with self.lock:
+            pending = list(self.watches)
+        for prompt_id in pending:
+            try:
+                if prompt_id in self.client.get_history(prompt_id):
+                    self._finish(prompt_id)
+            except Exception as e:
+                print(f"[ComfyUI] History check for {prompt_id} failed: {e}")
+
+    def _dispatch(self, message: Dict):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        if msg_type in ("execution_error", "execution_interrupted"):
+            self._finish(prompt_id, ComfyExecutionError(prompt_id, data))
+            return
+        if msg_type == "execution_success":
+            self._finish(prompt_id)
+            return
+        if msg_type == "executing" and data.get("node") is None:
+            # Execution finished
+            self._finish(prompt_id)
+            return
+
+        with self.lock:
+            watch = self.watches.get(prompt_id)
+        if watch is None:
+            return
+
+        if watch.started_at is None and msg_type in ("execution_start", "execution_cached", "executing"):
+            watch.started_at = time.time()
+        if msg_type == "execution_cached":
+            watch.done_nodes.update(str(n) for n in data.get("nodes", []))
+            watch.report_progress()
+        elif msg_type == "executing":
+            if watch.current_node:
+                watch.done_nodes.add(watch.current_node)
+            watch.current_node = str(data["node"])
+            watch.report_progress()
+        elif msg_type == "executed":
+            watch.done_nodes.add(str(data.get("node")))
+            watch.report_progress()
+        elif msg_type == "progress":
+            maximum = data.get("max") or 0
+            if maximum > 0:
+                watch.report_progress(min(data.get("value", 0) / maximum, 1.0))
 
 class ComfyUIClient:
-    def __init__(self, server_address="127.0.0.1:8000"):
+    """
+    Long-lived client for one ComfyUI server.
+
+    HTTP calls share a keep-alive requests.Session, and the WebSocket is kept
+    open between prompts and reconnected on demand, so a task only pays for
+    connection setup when the previous connection actually dropped.
+    """
+    def __init__(self, server_address="127.0.0.1:8000", pool_maxsize: int = 4, http_timeout=(10, 300),
+                 execution_timeout: float = 300, queue_timeout: float = 3600):
         server_address = server_address.rstrip('/')
         self.server_address = server_address
+        # Limits for wait_for_completion: running time from execution_start, and
+        # time spent in the server's queue before that (behind other prompts)
+        self.execution_timeout = execution_timeout
+        self.queue_timeout = queue_timeout
         self.client_id = str(uuid.uuid4())
         self.ws = None
+        self.ws_lock = threading.Lock()
+        self.http_timeout = http_timeout
+        self.listener = ComfyEventListener(self)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
         # Handle scheme in server_address
         if server_address.startswith("http://"):
@@ -27,29 +238,58 @@ class ComfyUIClient:
             self.http_base = f"http://{server_address}"
             self.ws_url = f"ws://{server_address}/ws?clientId={self.client_id}"
 
-    def connect(self):
-        """Connect to the WebSocket server."""
-        self.ws = websocket.WebSocket()
-        self.ws.connect(self.ws_url)
+    def connect(self, retries: int = 3, backoff: float = 1.0):
+        """
+        (Re)connect to the WebSocket server, keeping the same client_id so
+        ComfyUI keeps routing our prompts' events to the new socket.
+        """
+        with self.ws_lock:
+            if self.ws is not None:
+                try:
+                    self.ws.close()
+                except Exception:
+                    pass
+                self.ws = None
+
+            last_error = None
+            for attempt in range(retries):
+                try:
+                    ws = websocket.WebSocket()
+                    ws.connect(self.ws_url, timeout=self.http_timeout[0])
+                    self.ws = ws
+                    return
+                except Exception as e:
+                    last_error = e
+                    time.sleep(backoff * (2 ** attempt))
+            raise ConnectionError(f"Unable to connect WebSocket {self.ws_url}: {last_error}")
+
+    def ensure_connected(self):
+        if self.ws is None or not self.ws.connected:
+            self.connect()
 
     def close(self):
-        if self.ws:
-            self.ws.close()
+        self.listener.stop()
+        with self.ws_lock:
+            if self.ws:
+                self.ws.close()
+                self.ws = None
+        self.session.close()
 
-    def upload_image(self, file_path: str, subfolder: str = "", overwrite: bool = False, image_type: str = "input") -> Dict:
+    def upload_image(self, file_path: str, subfolder: str = "", overwrite: bool = False, image_type: str = "input",
+                     name: Optional[str] = None) -> Dict:
         """
-        Upload an image to ComfyUI.
+        Upload an image to ComfyUI, as `name` if given, else under its own basename.
         """
         url = f"{self.http_base}/upload/image"
-        filename = os.path.basename(file_path)
-        with open(file_path, 'rb') as f:
+        filename = name or os.path.basename(file_path)
+        with tracing.span("comfyui.upload_image", bytes=os.path.getsize(file_path)), open(file_path, 'rb') as f:
             files = {'image': (filename, f)}
             data = {
                 'subfolder': subfolder,
                 'overwrite': 'true' if overwrite else 'false',
                 'type': image_type
             }
-            response = requests.post(url, files=files, data=data)
+            response = self.session.post(url, files=files, data=data, timeout=self.http_timeout)
             response.raise_for_status()
             return response.json()
 
@@ -58,10 +298,14 @@ class ComfyUIClient:
         Queue a workflow (API format prompt).
         Returns the prompt_id.
         """
+        # ComfyUI only sends events to sockets connected at the time, so listen first
+        self.listener.start()
+
         p = {"prompt": prompt, "client_id": self.client_id}
         url = f"{self.http_base}/prompt"
-        response = requests.post(url, json=p)
-        response.raise_for_status()
+        with tracing.span("comfyui.queue_prompt", nodes=len(prompt)):
+            response = self.session.post(url, json=p, timeout=self.http_timeout)
+            response.raise_for_status()
         try:
             return response.json()['prompt_id']
         except KeyError:
@@ -70,42 +314,118 @@ class ComfyUIClient:
 
     def get_history(self, prompt_id: str) -> Dict:
         url = f"{self.http_base}/history/{prompt_id}"
-        response = requests.get(url)
+        with tracing.span("comfyui.get_history"):
+            response = self.session.get(url, timeout=self.http_timeout)
+            response.raise_for_status()
+            return response.json()
+
+    def get_system_stats(self, timeout: float = 5) -> Dict:
+        response = self.session.get(f"{self.http_base}/system_stats", timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_queue(self, timeout: float = 5) -> Dict:
+        response = self.session.get(f"{self.http_base}/queue", timeout=timeout)
         response.raise_for_status()
         return response.json()
 
+    def cancel_prompt(self, prompt_id: str):
+        """
+        Stop a prompt: interrupt it if it is the one running, otherwise delete it
+        from the queue, so other clients' prompts are left alone.
+        """
+        try:
+            queue_info = self.get_queue(timeout=5)
+            running = [item[1] for item in queue_info.get("queue_running", []) if len(item) > 1]
+            if prompt_id in running:
+                response = self.session.post(f"{self.http_base}/interrupt", json={"prompt_id": prompt_id}, timeout=self.http_timeout)
+            else:
+                response = self.session.post(f"{self.http_base}/queue", json={"delete": [prompt_id]}, timeout=self.http_timeout)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"[ComfyUI] Failed to cancel prompt {prompt_id} on {self.server_address}: {e}")
+
     def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
         params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
         url = f"{self.http_base}/view"
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params, timeout=self.http_timeout)
         response.raise_for_status()
         return response.content
 
-    def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> Dict:
+    def download_output(self, filename: str, subfolder: str, folder_type: str, dest_path: str,
+                        progress_callback: Optional[Callable] = None, chunk_size: int = 1024 * 1024,
+                        cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        Stream an output file from /view to dest_path in bounded chunks.
+        Writes to a .part file first so a partial download never looks complete.
+        Returns the number of bytes written.
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        url = f"{self.http_base}/view"
+        tmp_path = dest_path + ".part"
+        written = 0
+        with tracing.span("comfyui.get_image", filename=filename) as sp, \
+                self.session.get(url, params=params, stream=True, timeout=self.http_timeout) as response:
+            response.raise_for_status()
+            total = int(response.headers.get('content-length') or 0)
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise TaskCanceledError("Output fetch canceled")
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    written += len(chunk)
+                    if progress_callback:
+                        progress_callback(written, total)
+            sp.set(bytes=written)
+        os.replace(tmp_path, dest_path)
+        return written
+
+    def wait_for_completion(self, prompt_id: str, timeout: Optional[float] = None, progress_callback: Optional[Callable] = None,
+                            total_nodes: int = 0, cancel_event: Optional[threading.Event] = None,
+                            queue_timeout: Optional[float] = None) -> Dict:
         """
-        Wait for the prompt to complete via WebSocket.
+        Wait for the prompt to complete via the shared WebSocket listener.
+        progress_callback(current, total) is fed from ComfyUI's per-node
+        events, measured in executed nodes out of total_nodes.
+        Setting cancel_event stops the prompt on the server and raises TaskCanceledError.
+        timeout bounds the execution from its execution_start event and
+        queue_timeout the wait before it (default: the client's limits); when
+        either runs out the prompt is stopped and PromptTimeoutError raised.
         Returns the output data (including image filenames).
         """
-        if not self.ws:
-            self.connect()
-        
-        start_time = time.time()
-        while True:
-            if time.time() - start_time > timeout:
-                raise TimeoutError("Workflow execution timed out")
-            
-            try:
-                out = self.ws.recv()
-                if isinstance(out, str):
-                    message = json.loads(out)
-                    if message['type'] == 'executing':
-                        data = message['data']
-                        if data['node'] is None and data['prompt_id'] == prompt_id:
-                            # Execution finished
-                            break
-            except Exception as e:
-                # Handle connection issues or reconnect if needed
-                raise e
+        timeout = self.execution_timeout if timeout is None else timeout
+        queue_timeout = self.queue_timeout if queue_timeout is None else queue_timeout
+        self.listener.start()
+        watch = self.listener.watch(prompt_id, total_nodes, progress_callback)
+        queued_at = time.time()
+        try:
+            while True:
+                # A prompt queued behind others only starts its clock once it runs
+                started = watch.started_at
+                deadline = started + timeout if started is not None else queued_at + queue_timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.cancel_prompt(prompt_id)
+                    raise PromptTimeoutError(f"Prompt {prompt_id} timed out "
+                                             f"{'executing' if started is not None else 'in the queue'}")
+                try:
+                    # Wake up regularly to notice cancellation and the start of execution
+                    watch.future.result(timeout=min(remaining, 0.5 if cancel_event is not None else 1.0))
+                    break
+                except FutureTimeoutError:
+                    if cancel_event is not None and cancel_event.is_set():
+                        self.cancel_prompt(prompt_id)
+                        raise TaskCanceledError(f"Prompt {prompt_id} canceled")
+        finally:
+            self.listener.unwatch(prompt_id)
+            # Time in ComfyUI's queue, then executing, split at its execution_start event
+            finished_at = time.time()
+            started_at = min(watch.started_at or finished_at, finished_at)
+            tracing.record("comfyui.queued", queued_at, started_at, prompt_id=prompt_id)
+            if watch.started_at is not None:
+                tracing.record("comfyui.execute", started_at, finished_at, prompt_id=prompt_id, nodes=total_nodes)
         
         # Get history to retrieve outputs
         history = self.get_history(prompt_id)
@@ -173,18 +493,91 @@ class WorkflowConverter:
             
         return prompt
 
-class NGSRWorkflow:
-    def __init__(self, workflow_path: str, client: Optional[ComfyUIClient] = None):
-        with open(workflow_path, 'r', encoding='utf-8') as f:
+class CompiledWorkflow:
+    """
+    A workflow file converted once to API format, with its key nodes resolved.
+    Instances are shared between tasks and must be treated as read-only.
+    """
+    def __init__(self, path: str, mtime: int):
+        with open(path, 'r', encoding='utf-8') as f:
             self.workflow_ui = json.load(f)
-        
+
+        self.path = path
+        self.mtime = mtime
         self.prompt = WorkflowConverter.convert_ui_to_api(self.workflow_ui)
-        self.client = client
-        
+        # Identifies what the workflow computes, independent of file name or formatting
+        self.fingerprint = hashlib.sha256(json.dumps(self.prompt, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
         # Identify key nodes
         self.load_image_node_id = self._find_node_id_by_type("LoadImage")
         self.load_video_node_id = self._find_node_id_by_type("VHS_LoadVideo") or self._find_node_id_by_type("LoadVideo")
-        self.seed_node_id = self._find_node_id_by_type("SeedVR2VideoUpscaler") or self._find_node_id_by_type("KSampler") 
+        self.seed_node_id = self._find_node_id_by_type("SeedVR2VideoUpscaler") or self._find_node_id_by_type("KSampler")
+        # Upscalers that take a target resolution (e.g. SeedVR2) rather than a fixed factor
+        self.resolution_node_id = next(
+            (node_id for node_id, node in self.prompt.items()
+             if isinstance(node["inputs"].get("resolution"), (int, float))),
+            None
+        )
+
+    def _find_node_id_by_type(self, type_name: str) -> Optional[str]:
+        for node_id, node_data in self.prompt.items():
+            if node_data["class_type"] == type_name:
+                return node_id
+        return None
+
+class AllSet:
+    """Reads as set once every one of `events` is set: a batch prompt stops only when all its tasks are canceled."""
+    def __init__(self, events: List[threading.Event]):
+        self.events = events
+
+    def is_set(self) -> bool:
+        return all(event.is_set() for event in self.events)
+
+class WorkflowRegistry:
+    """
+    Process-wide cache of compiled workflows keyed by absolute path.
+    An entry is recompiled when the file's mtime changes.
+    """
+    def __init__(self):
+        self._compiled: Dict[str, CompiledWorkflow] = {}
+        self.lock = threading.Lock()
+
+    def get(self, workflow_path: str) -> CompiledWorkflow:
+        path = os.path.abspath(workflow_path)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            compiled = self._compiled.get(path)
+        if compiled and compiled.mtime == mtime:
+            return compiled
+
+        # Compile outside the lock; a concurrent duplicate compile is harmless
+        compiled = CompiledWorkflow(path, mtime)
+        with self.lock:
+            self._compiled[path] = compiled
+        return compiled
+
+    def clear(self):
+        with self.lock:
+            self._compiled.clear()
+
+workflow_registry = WorkflowRegistry()
+
+class NGSRWorkflow:
+    def __init__(self, workflow_path: str, client: Optional[ComfyUIClient] = None):
+        self.template = workflow_registry.get(workflow_path)
+        self.workflow_ui = self.template.workflow_ui
+
+        # Copy-on-write: node dicts are shared with the template until a setter
+        # touches them, see _writable_inputs
+        self.prompt = dict(self.template.prompt)
+        self._owned_nodes = set()
+        self.client = client
+
+        self.load_image_node_id = self.template.load_image_node_id
+        self.load_video_node_id = self.template.load_video_node_id
+        self.seed_node_id = self.template.seed_node_id
+        self.resolution_node_id = self.template.resolution_node_id
 
     def _find_node_id_by_type(self, type_name: str) -> Optional[str]:
         for node_id, node_data in self.prompt.items():
@@ -192,32 +585,52 @@ class NGSRWorkflow:
                 return node_id
         return None
 
+    def _writable_inputs(self, node_id: str) -> Dict:
+        """Return the inputs of a node, copying the node out of the template on first write."""
+        if node_id not in self._owned_nodes:
+            node = self.prompt[node_id]
+            self.prompt[node_id] = {**node, "inputs": dict(node["inputs"])}
+            self._owned_nodes.add(node_id)
+        return self.prompt[node_id]["inputs"]
+
     def set_input(self, filename: str):
         # Try setting image first
         if self.load_image_node_id:
             if "image" in self.prompt[self.load_image_node_id]["inputs"]:
-                 self.prompt[self.load_image_node_id]["inputs"]["image"] = filename
+                 self._writable_inputs(self.load_image_node_id)["image"] = filename
         
         # Try setting video
         if self.load_video_node_id:
-            if "video" in self.prompt[self.load_video_node_id]["inputs"]:
-                self.prompt[self.load_video_node_id]["inputs"]["video"] = filename
-            elif "file" in self.prompt[self.load_video_node_id]["inputs"]:
-                 self.prompt[self.load_video_node_id]["inputs"]["file"] = filename
-            elif "upload" in self.prompt[self.load_video_node_id]["inputs"]:
-                 self.prompt[self.load_video_node_id]["inputs"]["upload"] = filename
+            inputs = self.prompt[self.load_video_node_id]["inputs"]
+            if "video" in inputs:
+                self._writable_inputs(self.load_video_node_id)["video"] = filename
+            elif "file" in inputs:
+                 self._writable_inputs(self.load_video_node_id)["file"] = filename
+            elif "upload" in inputs:
+                 self._writable_inputs(self.load_video_node_id)["upload"] = filename
 
     def set_seed(self, seed: int):
         if self.seed_node_id:
             if "seed" in self.prompt[self.seed_node_id]["inputs"]:
-                self.prompt[self.seed_node_id]["inputs"]["seed"] = seed
+                self._writable_inputs(self.seed_node_id)["seed"] = seed
             elif "noise_seed" in self.prompt[self.seed_node_id]["inputs"]:
-                self.prompt[self.seed_node_id]["inputs"]["noise_seed"] = seed
+                self._writable_inputs(self.seed_node_id)["noise_seed"] = seed
 
-    def run(self, input_path: str, output_dir: str = "./output") -> List[str]:
+    def set_resolution(self, resolution: int):
+        if self.resolution_node_id:
+            self._writable_inputs(self.resolution_node_id)["resolution"] = int(resolution)
+
+    def run(self, input_path: str, output_dir: str = "./output", progress_callback: Optional[Callable] = None, fetch_progress_callback: Optional[Callable] = None,
+            upload_name: Optional[str] = None, resolution: Optional[int] = None,
+            cancel_event: Optional[threading.Event] = None) -> List[str]:
         """
         Run the workflow for a local input file (image/video).
         Uploads input -> Runs -> Downloads result.
+        progress_callback(current, total) receives execution progress in nodes,
+        fetch_progress_callback(current, total) receives output download progress in bytes.
+        upload_name is the input's file name on the server (default: its basename).
+        resolution overrides the target resolution of resolution-based upscalers.
+        Setting cancel_event stops the run (and the prompt on the server) with TaskCanceledError.
         Returns list of output file paths.
         """
         if not self.client:
@@ -225,70 +638,141 @@ class NGSRWorkflow:
 
         # 1. Upload Input
         # Use overwrite=True to ensure we are using the file we just uploaded
-        upload_resp = self.client.upload_image(input_path, overwrite=True)
+        self._check_canceled(cancel_event)
+        upload_resp = self.client.upload_image(input_path, overwrite=True, name=upload_name)
         filename = upload_resp["name"]
         
         # 2. Update Workflow
         self.set_input(filename)
+        if resolution:
+            self.set_resolution(resolution)
         
         # 3. Queue
+        self._check_canceled(cancel_event)
         prompt_id = self.client.queue_prompt(self.prompt)
         
         # 4. Wait
-        result = self.client.wait_for_completion(prompt_id)
+        result = self.client.wait_for_completion(prompt_id, progress_callback=progress_callback, total_nodes=len(self.prompt),
+                                                 cancel_event=cancel_event)
         
-        # 5. Download Outputs
+        # 5. Download Outputs (streamed to disk, never held in memory)
         output_files = []
-        if 'outputs' in result:
-            for node_id, node_output in result['outputs'].items():
-                # Handle Images
-                if 'images' in node_output:
-                    for img in node_output['images']:
-                        img_data = self.client.get_image(img['filename'], img['subfolder'], img['type'])
-                        
-                        os.makedirs(output_dir, exist_ok=True)
-                        out_name = f"{img['filename']}"
-                        out_path = os.path.join(output_dir, out_name)
-                        
-                        with open(out_path, 'wb') as f:
-                            f.write(img_data)
-                        output_files.append(out_path)
-                
-                # Handle GIFs/Videos (VHS_VideoCombine often returns gifs or filenames in different keys)
-                if 'gifs' in node_output:
-                    for gif in node_output['gifs']:
-                        img_data = self.client.get_image(gif['filename'], gif['subfolder'], gif['type'])
-                        
-                        os.makedirs(output_dir, exist_ok=True)
-                        out_name = f"{gif['filename']}"
-                        out_path = os.path.join(output_dir, out_name)
-                        
-                        with open(out_path, 'wb') as f:
-                            f.write(img_data)
-                        output_files.append(out_path)
-
-                if 'videos' in node_output:
-                    for video in node_output['videos']:
-                        img_data = self.client.get_image(video['filename'], video['subfolder'], video['type'])
-                        
-                        os.makedirs(output_dir, exist_ok=True)
-                        out_name = f"{video['filename']}"
-                        out_path = os.path.join(output_dir, out_name)
-                        
-                        with open(out_path, 'wb') as f:
-                            f.write(img_data)
-                        output_files.append(out_path)
+        with tracing.span("comfyui.fetch_outputs"):
+            for node_id, node_output in result.get('outputs', {}).items():
+                output_files += self._download_node_outputs(node_output, output_dir, fetch_progress_callback, cancel_event)
+
+        return output_files
+
+    @staticmethod
+    def _check_canceled(cancel_event: Optional[threading.Event]):
+        if cancel_event is not None and cancel_event.is_set():
+            raise TaskCanceledError("Run canceled")
 
+    def _download_node_outputs(self, node_output: Dict, output_dir: str, fetch_progress_callback: Optional[Callable] = None,
+                               cancel_event: Optional[threading.Event] = None) -> List[str]:
+        output_files = []
+        # Images, plus GIFs/Videos (VHS_VideoCombine often returns gifs or filenames in different keys)
+        for key in ('images', 'gifs', 'videos'):
+            for item in node_output.get(key, []):
+                os.makedirs(output_dir, exist_ok=True)
+                out_path = os.path.join(output_dir, item['filename'])
+                self.client.download_output(
+                    item['filename'], item['subfolder'], item['type'], out_path,
+                    progress_callback=fetch_progress_callback, cancel_event=cancel_event
+                )
+                output_files.append(out_path)
         return output_files
 
-def run_workflow_task(server_address: str, workflow_path: str, input_path: str, output_dir: str):
+    def _input_dependent_nodes(self) -> List[str]:
+        """The image loader and every node downstream of it."""
+        dependent = {self.load_image_node_id}
+        changed = True
+        while changed:
+            changed = False
+            for node_id, node in self.prompt.items():
+                if node_id in dependent:
+                    continue
+                if any(isinstance(v, (list, tuple)) and len(v) == 2 and v[0] in dependent for v in node["inputs"].values()):
+                    dependent.add(node_id)
+                    changed = True
+        return [node_id for node_id in self.prompt if node_id in dependent]
+
+    def run_batch(self, input_paths: List[str], output_dirs: List[str], progress_callback: Optional[Callable] = None,
+                  upload_names: Optional[List[str]] = None,
+                  cancel_events: Optional[List[threading.Event]] = None) -> List[List[str]]:
+        """
+        Run several images through the workflow as one prompt. The loader and
+        everything downstream of it is replicated once per image; nodes that
+        don't depend on the input (model loaders) are shared by all copies.
+        cancel_events holds one event per input: the prompt is stopped with
+        TaskCanceledError once all are set, and the outputs of inputs whose
+        event is set are not fetched.
+        Returns the output file paths of each input, in order.
+        """
+        all_canceled = AllSet(cancel_events) if cancel_events else None
+        if not self.client:
+            raise ValueError("Client not initialized")
+        if not self.load_image_node_id:
+            raise InvalidTaskError("Batching needs a workflow with a LoadImage node")
+
+        self._check_canceled(all_canceled)
+        dependent = self._input_dependent_nodes()
+        prompt = {node_id: node for node_id, node in self.prompt.items() if node_id not in dependent}
+        owner = {} # replicated node id -> input index
+        for index, input_path in enumerate(input_paths):
+            name = upload_names[index] if upload_names else None
+            filename = self.client.upload_image(input_path, overwrite=True, name=name)["name"]
+            for node_id in dependent:
+                node = self.prompt[node_id]
+                inputs = {
+                    key: [f"b{index}_{v[0]}", v[1]] if isinstance(v, (list, tuple)) and len(v) == 2 and v[0] in dependent else v
+                    for key, v in node["inputs"].items()
+                }
+                if node_id == self.load_image_node_id:
+                    inputs["image"] = filename
+                prompt[f"b{index}_{node_id}"] = {**node, "inputs": inputs}
+                owner[f"b{index}_{node_id}"] = index
+
+        self._check_canceled(all_canceled)
+        prompt_id = self.client.queue_prompt(prompt)
+        result = self.client.wait_for_completion(prompt_id, progress_callback=progress_callback, total_nodes=len(prompt),
+                                                 cancel_event=all_canceled)
+
+        output_files = [[] for _ in input_paths]
+        with tracing.span("comfyui.fetch_outputs"):
+            for node_id, node_output in result.get('outputs', {}).items():
+                index = owner.get(node_id)
+                if index is not None and not (cancel_events and cancel_events[index].is_set()):
+                    output_files[index] += self._download_node_outputs(node_output, output_dirs[index])
+        return output_files
+
+def run_workflow_batch(workflow_path: str, input_paths: List[str], output_dirs: List[str], client: ComfyUIClient,
+                       progress_callback: Optional[Callable] = None, upload_names: Optional[List[str]] = None,
+                       cancel_events: Optional[List[threading.Event]] = None) -> List[List[str]]:
+    """Run several inputs through a workflow as a single prompt on `client`'s server."""
+    wf = NGSRWorkflow(workflow_path, client)
+    return wf.run_batch(input_paths, output_dirs, progress_callback=progress_callback, upload_names=upload_names,
+                        cancel_events=cancel_events)
+
+def run_workflow_task(server_address: str, workflow_path: str, input_path: str, output_dir: str, client: Optional[ComfyUIClient] = None,
+                      progress_callback: Optional[Callable] = None, fetch_progress_callback: Optional[Callable] = None,
+                      upload_name: Optional[str] = None, resolution: Optional[int] = None,
+                      cancel_event: Optional[threading.Event] = None):
     """
     Helper for parallel execution.
+    Reuses `client` when given (its connections stay open), otherwise creates
+    a throwaway client for this call.
     """
+    if client is not None:
+        wf = NGSRWorkflow(workflow_path, client)
+        return wf.run(input_path, output_dir, progress_callback=progress_callback, fetch_progress_callback=fetch_progress_callback,
+                      upload_name=upload_name, resolution=resolution, cancel_event=cancel_event)
+
     client = ComfyUIClient(server_address)
     try:
         client.connect()
         wf = NGSRWorkflow(workflow_path, client)
-        return wf.run(input_path, output_dir)
+        return wf.run(input_path, output_dir, progress_callback=progress_callback, fetch_progress_callback=fetch_progress_callback,
+                      upload_name=upload_name, resolution=resolution, cancel_event=cancel_event)
     finally:
         client.close()
@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from .errors import TaskCanceledError
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+class _RangeIgnored(IOError):
+    """A range request was answered with the whole file."""
+
+
+class RangedDownloader:
+    """
+    HTTP download engine for task inputs.
+
+    The first request asks for a single byte. If the server answers 206 with a
+    known size, large files are fetched as parallel byte ranges written in place,
+    each range retried on its own from where it stopped. Otherwise the response
+    is streamed to disk in bounded chunks, whether or not a length is known.
+    """
+    def __init__(self, threads: int = 4, part_size: int = 16 * 1024 * 1024, chunk_size: int = 1024 * 1024,
+                 min_parallel_size: int = 32 * 1024 * 1024, retries: int = 3, timeout=(10, 60),
+                 headers: Optional[Dict] = None):
+        self.threads = max(1, threads)
+        self.part_size = part_size
+        self.chunk_size = chunk_size
+        self.min_parallel_size = min_parallel_size
+        self.retries = retries
+        self.timeout = timeout
+        self.headers = headers or DEFAULT_HEADERS
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.threads * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def download(self, url: str, local_path: str, progress_callback: Optional[Callable] = None,
+                 cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        Download url to local_path, reporting (current, total) bytes.
+        total is 0 while the size is unknown. Setting cancel_event aborts the
+        transfer with TaskCanceledError. Returns the number of bytes written.
+        """
+        tmp_path = local_path + ".part"
+        probe_headers = {**self.headers, "Range": "bytes=0-0"}
+        with self.session.get(url, headers=probe_headers, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            total = self._parse_content_range(r.headers.get("content-range"))
+            etag = r.headers.get("etag")
+            # If-Range only accepts strong validators; a weak ETag would make
+            # compliant servers send the whole file for every range
+            validator = etag if etag and not etag.startswith("W/") else r.headers.get("last-modified")
+            if r.status_code != 206:
+                # Range ignored: this response already carries the whole body
+                written = self._stream_response(r, tmp_path, progress_callback, cancel_event)
+                os.replace(tmp_path, local_path)
+                return written
+
+        written = None
+        if total is not None and total >= self.min_parallel_size and self.threads > 1:
+            try:
+                written = self._download_ranges(url, tmp_path, total, validator, progress_callback, cancel_event)
+            except _RangeIgnored as e:
+                # Ranges not honoured after all (or the file changed): fetch it in one stream
+                print(f"[Download] {e}, falling back to a single stream")
+        if written is None:
+            with self.session.get(url, headers=self.headers, stream=True, timeout=self.timeout) as r:
+                r.raise_for_status()
+                written = self._stream_response(r, tmp_path, progress_callback, cancel_event)
+        os.replace(tmp_path, local_path)
+        return written
+
+    def probe(self, url: str) -> Dict:
+        """
+        Cheap metadata lookup (a one-byte range request).
+        Returns {"size", "etag", "last_modified"}, any of which may be None.
+        """
+        probe_headers = {**self.headers, "Range": "bytes=0-0"}
+        with self.session.get(url, headers=probe_headers, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            if r.status_code == 206:
+                size = self._parse_content_range(r.headers.get("content-range"))
+            else:
+                length = r.headers.get("content-length")
+                size = int(length) if length else None
+            return {
+                "size": size,
+                "etag": r.headers.get("etag"),
+                "last_modified": r.headers.get("last-modified")
+            }
+
+    @staticmethod
+    def _parse_content_range(value: Optional[str]) -> Optional[int]:
+        # e.g. "bytes 0-0/123456"; the size may be "*" when unknown
+        if not value:
+            return None
+        match = re.match(r"bytes\s+\d+-\d+/(\d+)", value)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _check_canceled(cancel_event: Optional[threading.Event]):
+        if cancel_event is not None and cancel_event.is_set():
+            raise TaskCanceledError("Download canceled")
+
+    def _stream_response(self, r, path: str, progress_callback: Optional[Callable],
+                         cancel_event: Optional[threading.Event] = None) -> int:
+        total = int(r.headers.get("content-length") or 0)
+        written = 0
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                self._check_canceled(cancel_event)
+                if not chunk:
+                    continue
+                f.write(chunk)
+                written += len(chunk)
+                if progress_callback:
+                    progress_callback(written, total)
+        if progress_callback:
+            progress_callback(written, written)
+        return written
+
+    def _split(self, total: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.part_size, total) - 1) for start in range(0, total, self.part_size)]
+
+    def _download_ranges(self, url: str, path: str, total: int, validator: Optional[str], progress_callback: Optional[Callable],
+                         cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        Fetch `total` bytes as parallel ranges. `validator` is a strong ETag or
+        a Last-Modified date sent as If-Range. Raises _RangeIgnored when the
+        server answers a range with the whole file.
+        """
+        with open(path, "wb") as f:
+            f.truncate(total)
+
+        done = [0]
+        done_lock = threading.Lock()
+        ignored = threading.Event()
+
+        def advance(n):
+            with done_lock:
+                done[0] += n
+                current = done[0]
+            if progress_callback:
+                progress_callback(current, total)
+
+        def fetch(part):
+            start, end = part
+            pos = start
+            last_error = None
+            for attempt in range(self.retries + 1):
+                if ignored.is_set():
+                    return
+                headers = {**self.headers, "Range": f"bytes={pos}-{end}"}
+                if validator:
+                    # Get the whole file rather than mixed bytes if it changed between ranges
+                    headers["If-Range"] = validator
+                try:
+                    with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                        r.raise_for_status()
+                        if r.status_code != 206:
+                            ignored.set()
+                            raise _RangeIgnored(f"Server ignored range request for bytes {pos}-{end}")
+                        with open(path, "r+b") as f:
+                            f.seek(pos)
+                            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                                self._check_canceled(cancel_event)
+                                if not chunk:
+                                    continue
+                                f.write(chunk)
+                                pos += len(chunk)
+                                advance(len(chunk))
+                    if pos > end:
+                        return
+                    last_error = IOError(f"Range {start}-{end} ended early at {pos}")
+                except _RangeIgnored:
+                    raise
+                except (requests.RequestException, IOError) as e:
+                    last_error = e
+                print(f"[Download] Range {start}-{end} attempt {attempt + 1} failed: {last_error}")
+            raise IOError(f"Failed to download bytes {start}-{end} of {url}: {last_error}")
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            # list() re-raises the first failed range
+            list(pool.map(fetch, self._split(total)))
+        return total
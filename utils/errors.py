@@ -0,0 +1,6 @@
+class TaskCanceledError(Exception):
+    """Raised inside a transfer or prompt wait when its task was canceled."""
+
+
+class InvalidTaskError(ValueError):
+    """The task's input or workflow can't be processed; retrying would fail the same way."""
@@ -0,0 +1,188 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds, from a small image's download to a long video's processing
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+Labels = Tuple[str, ...]
+
+
+class _Metric:
+    """
+    Base of the sharded metrics. Every thread records into its own dict, so the
+    hot path takes no lock; a scrape sums the shards. Shards of threads that
+    have exited are folded into `retired` whenever a new thread registers its
+    shard or a scrape runs, so short-lived threads don't pile up unscraped.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        """Fold the shards of exited threads into `retired`. Caller holds self._lock."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+
+    def _merge(self, into: Dict, shard: Dict):
+        raise NotImplementedError
+
+    def _collect(self) -> Dict:
+        with self._lock:
+            self._retire_dead()
+            total: Dict = {}
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                # A copy is taken in one step; the owner may add keys meanwhile
+                self._merge(total, dict(shard))
+        return total
+
+    def samples(self) -> Iterable[Tuple[str, Labels, Tuple[str, ...], float]]:
+        """(suffix, label values, extra label pairs, value) tuples for the exposition."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def _merge(self, into, shard):
+        for labels, value in shard.items():
+            into[labels] = into.get(labels, 0.0) + value
+
+    def samples(self):
+        for labels, value in sorted(self._collect().items()):
+            yield "", labels, (), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        # Per bucket counts (non-cumulative, the last one is +Inf), then sum
+        cells = shard.get(labels)
+        if cells is None:
+            cells = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def _merge(self, into, shard):
+        for labels, cells in shard.items():
+            cells = list(cells)
+            target = into.get(labels)
+            if target is None:
+                into[labels] = cells
+            else:
+                for i, value in enumerate(cells):
+                    target[i] += value
+
+    def samples(self):
+        for labels, cells in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), cells[:-1]):
+                cumulative += count
+                yield "_bucket", labels, ("le", _format_value(bound)), cumulative
+            yield "_sum", labels, (), cells[-1]
+            yield "_count", labels, (), cumulative
+
+
+class GaugeFunc:
+    """
+    A gauge (or counter, with kind="counter") read at scrape time from
+    `fn() -> {label values: value}`, for figures the owner already keeps.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], fn: Callable[[], Dict[Labels, float]],
+                 kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+        REGISTRY.register(self)
+
+    def samples(self):
+        for labels, value in sorted(self.fn().items()):
+            yield "", labels, (), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            # Re-registering a name (e.g. a new TaskManager) replaces the old collector
+            self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Metrics error in {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, extra, value in samples:
+                pairs = list(zip(metric.labelnames, labels))
+                if extra:
+                    pairs.append(extra)
+                label_str = ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+                lines.append(f"{metric.name}{suffix}{{{label_str}}} {_format_value(value)}" if label_str
+                             else f"{metric.name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+# Shared by the task pipeline (source and OSS) and the ComfyUI pool
+TRANSFER_BYTES = Counter("tmlsr_transfer_bytes_total", "Bytes moved, by peer (source, oss, comfyui) and direction (in, out).",
+                         ("peer", "direction"))
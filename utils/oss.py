@@ -1,5 +1,6 @@
 import os
 import oss2
+from .errors import TaskCanceledError
 from server.config import settings
 
 class OSSHandler:
@@ -9,21 +10,67 @@ class OSSHandler:
         self.access_key_id = self.config.get("access_key_id")
         self.access_key_secret = self.config.get("access_key_secret")
         self.bucket_name = self.config.get("bucket_name")
+
+        # Multipart upload tuning: files at or above the threshold are uploaded
+        # in parallel parts, with a checkpoint so a retry resumes instead of restarting
+        self.multipart_threshold = int(self.config.get("multipart_threshold_mb", 100) * 1024 * 1024)
+        self.part_size = int(self.config.get("part_size_mb", 10) * 1024 * 1024)
+        self.upload_threads = self.config.get("upload_threads", 4)
+        self.checkpoint_dir = self.config.get("checkpoint_dir", ".oss_checkpoints")
         
         if self.access_key_id and self.access_key_secret and self.endpoint and self.bucket_name:
+            # Each part thread needs its own pooled connection
+            if oss2.defaults.connection_pool_size < self.upload_threads:
+                oss2.defaults.connection_pool_size = self.upload_threads
             self.auth = oss2.Auth(self.access_key_id, self.access_key_secret)
             self.bucket = oss2.Bucket(self.auth, self.endpoint, self.bucket_name)
         else:
             print("Warning: OSS config missing. OSSHandler disabled.")
             self.bucket = None
 
-    def upload_file(self, local_path, oss_path, progress_callback=None):
+    def upload_file(self, local_path, oss_path, progress_callback=None, cancel_event=None):
+        """
+        Upload a file, returning False on failure. Setting cancel_event aborts
+        the upload with TaskCanceledError.
+        """
         if not self.bucket:
             return False
-        
+
+        if cancel_event is not None:
+            report = progress_callback
+
+            def progress_callback(consumed, total):
+                if cancel_event.is_set():
+                    raise TaskCanceledError("Upload canceled")
+                if report:
+                    report(consumed, total)
+
         try:
-            self.bucket.put_object_from_file(oss_path, local_path, progress_callback=progress_callback)
+            if os.path.getsize(local_path) >= self.multipart_threshold:
+                self._upload_multipart(local_path, oss_path, progress_callback)
+            else:
+                self.bucket.put_object_from_file(oss_path, local_path, progress_callback=progress_callback)
             return True
         except Exception as e:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TaskCanceledError("Upload canceled")
             print(f"OSS upload failed: {e}")
             return False
+
+    def _upload_multipart(self, local_path, oss_path, progress_callback=None):
+        """
+        Parallel, resumable multipart upload.
+        oss2 records finished parts under checkpoint_dir, so calling this again
+        for the same file and key only uploads the missing parts. progress_callback
+        receives aggregate (consumed, total) across all part threads.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        store = oss2.ResumableStore(root=os.path.abspath(self.checkpoint_dir))
+        oss2.resumable_upload(
+            self.bucket, oss_path, local_path,
+            store=store,
+            multipart_threshold=self.multipart_threshold,
+            part_size=self.part_size,
+            num_threads=self.upload_threads,
+            progress_callback=progress_callback
+        )
@@ -0,0 +1,106 @@
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]
+
+
+def _starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Last tile flush with the edge
+    starts.append(length - tile)
+    return starts
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: int) -> List[Box]:
+    """
+    Cover a width x height image with tiles of at most tile_size pixels a side,
+    neighbours overlapping by at least `overlap` pixels. Returns (left, top, right, bottom) boxes.
+    """
+    overlap = max(0, min(overlap, tile_size // 2))
+    stride = tile_size - overlap
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in _starts(height, tile_size, stride)
+        for x in _starts(width, tile_size, stride)
+    ]
+
+
+def split_image(input_path: str, output_dir: str, tile_size: int, overlap: int) -> Dict:
+    """
+    Cut an image into overlapping PNG tiles.
+    Returns {"size": (width, height), "tiles": [{"box": box, "path": path}, ...]}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(input_path) as img:
+        img.load()
+        size = img.size
+        tiles = []
+        for index, box in enumerate(plan_tiles(size[0], size[1], tile_size, overlap)):
+            path = os.path.join(output_dir, f"tile_{index:03d}.png")
+            img.crop(box).save(path)
+            tiles.append({"box": box, "path": path})
+    return {"size": size, "tiles": tiles}
+
+
+def _ramp_weights(box: Box, size: Tuple[int, int], overlap: int, scale: float) -> np.ndarray:
+    """
+    Blend weights for one tile at output scale: 1 inside, falling off linearly
+    across the overlap on every side that borders another tile.
+    """
+    left, top, right, bottom = box
+    out_w = int(round((right - left) * scale))
+    out_h = int(round((bottom - top) * scale))
+    ramp = max(1, int(round(overlap * scale)))
+
+    def axis(length, low_edge, high_edge):
+        w = np.ones(length, dtype=np.float32)
+        n = min(ramp, length)
+        fade = (np.arange(n, dtype=np.float32) + 1) / (n + 1)
+        if not low_edge:
+            w[:n] = np.minimum(w[:n], fade)
+        if not high_edge:
+            w[-n:] = np.minimum(w[-n:], fade[::-1])
+        return w
+
+    wx = axis(out_w, left == 0, right == size[0])
+    wy = axis(out_h, top == 0, bottom == size[1])
+    return np.outer(wy, wx)
+
+
+def blend_tiles(size: Tuple[int, int], boxes: List[Box], tile_outputs: List[str], overlap: int, output_path: str) -> str:
+    """
+    Reassemble processed tiles into one image, feathering the overlaps.
+    The output scale is taken from the first tile; tiles that come back a pixel
+    or two off (rounding in the workflow) are resized to fit.
+    """
+    with Image.open(tile_outputs[0]) as first:
+        scale = first.size[0] / (boxes[0][2] - boxes[0][0])
+        mode = "RGBA" if first.mode in ("RGBA", "LA") else "RGB"
+
+    out_w, out_h = int(round(size[0] * scale)), int(round(size[1] * scale))
+    channels = 4 if mode == "RGBA" else 3
+    canvas = np.zeros((out_h, out_w, channels), dtype=np.float32)
+    weight = np.zeros((out_h, out_w, 1), dtype=np.float32)
+
+    for box, path in zip(boxes, tile_outputs):
+        x0, y0 = int(round(box[0] * scale)), int(round(box[1] * scale))
+        w = _ramp_weights(box, size, overlap, scale)
+        with Image.open(path) as tile:
+            tile = tile.convert(mode)
+            if tile.size != (w.shape[1], w.shape[0]):
+                tile = tile.resize((w.shape[1], w.shape[0]), Image.LANCZOS)
+            pixels = np.asarray(tile, dtype=np.float32)
+        # Clip at the canvas edge, where rounding can overshoot by a pixel
+        h_fit, w_fit = min(w.shape[0], out_h - y0), min(w.shape[1], out_w - x0)
+        w, pixels = w[:h_fit, :w_fit], pixels[:h_fit, :w_fit]
+        canvas[y0:y0 + h_fit, x0:x0 + w_fit] += pixels * w[..., None]
+        weight[y0:y0 + h_fit, x0:x0 + w_fit] += w[..., None]
+
+    result = canvas / np.maximum(weight, 1e-6)
+    Image.fromarray(np.clip(np.rint(result), 0, 255).astype(np.uint8)).save(output_path)
+    return output_path
@@ -0,0 +1,229 @@
+import os
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "end", "thread", "attrs")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], start: float, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.thread = threading.current_thread().name
+        self.attrs = attrs
+
+
+class Trace:
+    """The spans of one task, across its stages, workers and retries."""
+    def __init__(self, trace_id: str, max_spans: int = 5000):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def add(self, name: str, parent_id: Optional[str], start: float, attrs: Dict[str, Any]) -> Span:
+        span = Span(self, name, parent_id, start, attrs)
+        with self.lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                # Still returned, so the caller's nesting works; just not kept
+                self.dropped += 1
+        return span
+
+    def snapshot(self) -> List[Span]:
+        with self.lock:
+            return list(self.spans)
+
+    def phases(self, root: Span) -> List[Dict]:
+        """
+        Finished spans under `root`, totalled by name in order of first start:
+        [{"name", "duration", "count"}]. Parallel parts add up, so a phase can
+        exceed the wall time of its stage.
+        """
+        spans = self.snapshot()
+        children: Dict[str, List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        totals: Dict[str, Dict] = OrderedDict()
+        stack = list(children.get(root.span_id, []))
+        found = []
+        while stack:
+            span = stack.pop()
+            found.append(span)
+            stack.extend(children.get(span.span_id, []))
+        for span in sorted(found, key=lambda s: s.start):
+            if span.end is None:
+                continue
+            phase = totals.setdefault(span.name, {"name": span.name, "duration": 0.0, "count": 0})
+            phase["duration"] += span.end - span.start
+            phase["count"] += 1
+        for phase in totals.values():
+            phase["duration"] = round(phase["duration"], 3)
+        return list(totals.values())
+
+
+class Tracer:
+    """A ring of the most recent task traces."""
+    def __init__(self, max_traces: int = 200, max_spans: int = 5000, enabled: bool = True):
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.enabled = enabled
+        self.traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def trace(self, trace_id: str) -> Optional[Trace]:
+        """The task's trace, started on first use; None while tracing is off."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            trace = self.traces.get(trace_id)
+            if trace is None:
+                trace = self.traces[trace_id] = Trace(trace_id, self.max_spans)
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+            return trace
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self.lock:
+            return self.traces.get(trace_id)
+
+    def recent(self) -> List[Trace]:
+        """Retained traces, newest first."""
+        with self.lock:
+            return list(reversed(self.traces.values()))
+
+
+# The spans new spans nest under: one per trace, several while one prompt serves a batch
+_current: contextvars.ContextVar[Tuple[Span, ...]] = contextvars.ContextVar("tmlsr_spans", default=())
+
+
+class SpanGroup:
+    """What `span()` yields: the open spans, one per trace. Empty when nothing is traced."""
+    __slots__ = ("spans",)
+
+    def __init__(self, spans: Tuple[Span, ...]):
+        self.spans = spans
+
+    def set(self, **attrs):
+        for span in self.spans:
+            span.attrs.update(attrs)
+
+
+@contextmanager
+def span(name: str, traces: Optional[Iterable[Optional[Trace]]] = None, **attrs):
+    """
+    Time a block as a span nested under the current one, or as a top-level span
+    of `traces` when given. Does nothing, cheaply, outside a traced task.
+    """
+    if traces is not None:
+        parents = [(trace, None) for trace in traces if trace is not None]
+    else:
+        parents = [(parent.trace, parent.span_id) for parent in _current.get()]
+    if not parents:
+        yield SpanGroup(())
+        return
+    start = time.time()
+    spans = tuple(trace.add(name, parent_id, start, dict(attrs)) for trace, parent_id in parents)
+    token = _current.set(spans)
+    try:
+        yield SpanGroup(spans)
+    except BaseException as e:
+        for s in spans:
+            s.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        end = time.time()
+        for s in spans:
+            s.end = end
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """Add an already finished span under the current one, e.g. from event timestamps."""
+    for parent in _current.get():
+        s = parent.trace.add(name, parent.span_id, start, dict(attrs))
+        s.end = end
+
+
+def record_in(trace: Optional[Trace], name: str, start: float, end: float, **attrs):
+    """Add a finished top-level span to `trace`."""
+    if trace is not None:
+        s = trace.add(name, None, start, dict(attrs))
+        s.end = end
+
+
+def bind(fn):
+    """Wrap `fn` to run inside a copy of the caller's span context, for handing work to other threads."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+# Export
+
+def to_chrome(trace: Trace) -> Dict:
+    """Chrome trace event format (chrome://tracing, Perfetto), one row per thread."""
+    spans = trace.snapshot()
+    threads: Dict[str, int] = {}
+    events = []
+    for s in sorted(spans, key=lambda s: s.start):
+        tid = threads.setdefault(s.thread, len(threads) + 1)
+        end = s.end if s.end is not None else time.time()
+        events.append({
+            "name": s.name, "cat": s.name.split(".")[0], "ph": "X", "pid": 1, "tid": tid,
+            "ts": int(s.start * 1e6), "dur": max(int((end - s.start) * 1e6), 0),
+            "args": {**s.attrs, "span_id": s.span_id, "parent_id": s.parent_id, "open": s.end is None}
+        })
+    meta = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": f"task {trace.trace_id}"}}]
+    meta += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}} for name, tid in threads.items()]
+    return {"traceEvents": meta + events, "displayTimeUnit": "ms", "otherData": {"trace_id": trace.trace_id, "dropped_spans": trace.dropped}}
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace, service_name: str = "tmlsr") -> Dict:
+    """OTLP/JSON (ExportTraceServiceRequest), ready to POST to a collector's /v1/traces."""
+    # Task IDs are 32 hex digits already; anything else is hashed into that shape
+    trace_id = trace.trace_id if len(trace.trace_id) == 32 else hashlib.md5(trace.trace_id.encode("utf-8")).hexdigest()
+    spans = []
+    for s in trace.snapshot():
+        end = s.end if s.end is not None else time.time()
+        attrs = {**s.attrs, "thread.name": s.thread}
+        spans.append({
+            "traceId": trace_id,
+            "spanId": s.span_id,
+            "parentSpanId": s.parent_id or "",
+            "name": s.name,
+            "kind": 1, # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(s.start * 1e9)),
+            "endTimeUnixNano": str(int(end * 1e9)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items()],
+            "status": {"code": 2, "message": str(s.attrs["error"])} if "error" in s.attrs else {}
+        })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "tmlsr"}, "spans": spans}]
+        }]
+    }
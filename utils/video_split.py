@@ -0,0 +1,88 @@
+import os
+import glob
+import json
+import shutil
+import subprocess
+from typing import Dict, List, Optional
+
+
+class VideoSplitter:
+    """
+    Local ffmpeg helpers for segment-parallel video processing: cut a video at
+    keyframes into segments without re-encoding, and join processed segments
+    back together with the original audio.
+    """
+
+    def __init__(self, ffmpeg: str = "ffmpeg", ffprobe: str = "ffprobe"):
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+
+    def available(self) -> bool:
+        """Whether both ffmpeg and ffprobe can be found."""
+        return all(shutil.which(binary) for binary in (self.ffmpeg, self.ffprobe))
+
+    def _run(self, args: List[str]):
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            error = result.stderr.decode("utf-8", errors="replace").strip().splitlines()
+            raise RuntimeError(f"{os.path.basename(args[0])} failed: {error[-1] if error else result.returncode}")
+        return result.stdout
+
+    def probe(self, path: str) -> Dict:
+        """Duration in seconds and whether the file has an audio stream."""
+        out = self._run([
+            self.ffprobe, "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type",
+            "-of", "json", path
+        ])
+        info = json.loads(out.decode("utf-8") or "{}")
+        streams = [s.get("codec_type") for s in info.get("streams", [])]
+        return {
+            "duration": float(info.get("format", {}).get("duration") or 0.0),
+            "has_audio": "audio" in streams
+        }
+
+    def split(self, input_path: str, output_dir: str, segments: int, duration: float) -> List[str]:
+        """
+        Cut the video stream into about `segments` equal parts. Streams are
+        copied, so cuts land on the first keyframe after each split point and
+        there may be fewer parts than asked for. Audio is dropped; concat()
+        takes it from the original.
+        Returns the segment paths in order.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        ext = os.path.splitext(input_path)[1] or ".mp4"
+        pattern = os.path.join(output_dir, f"segment_%03d{ext}")
+        split_points = ",".join(f"{duration * i / segments:.3f}" for i in range(1, segments))
+        args = [self.ffmpeg, "-y", "-v", "error", "-i", input_path, "-map", "0:v:0", "-an", "-c", "copy"]
+        if split_points:
+            args += ["-f", "segment", "-segment_times", split_points, "-reset_timestamps", "1", pattern]
+        else:
+            args += [pattern % 0]
+        self._run(args)
+        return sorted(glob.glob(os.path.join(output_dir, f"segment_*{ext}")))
+
+    def concat(self, segment_paths: List[str], output_path: str, audio_source: Optional[str] = None) -> str:
+        """
+        Join segments that share codec parameters without re-encoding, muxing in
+        the audio of `audio_source` if it has any.
+        """
+        list_path = output_path + ".txt"
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        tmp_path = output_path + ".part" + os.path.splitext(output_path)[1]
+        args = [self.ffmpeg, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+        if audio_source:
+            args += ["-i", audio_source, "-map", "0:v", "-map", "1:a?"]
+        args += ["-c", "copy", tmp_path]
+        try:
+            self._run(args)
+            os.replace(tmp_path, output_path)
+        finally:
+            for path in (list_path, tmp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return output_path